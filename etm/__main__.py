@@ -53,13 +53,17 @@ def main():
     ical.logger = logger
     import etm.data as data
     data.secret = secret
+    data.logger = logger
     from etm.data import Mask
     dbfile = os.path.normpath(os.path.join(etmdir, 'db.json'))
     logger.debug(f"using dbfile: {dbfile}")
     cfgfile = os.path.normpath(os.path.join(etmdir, 'cfg.yaml'))
-    ETMDB = data.initialize_tinydb(dbfile)
-    DBITEM = ETMDB.table('items', cache_size=None)
-    DBARCH = ETMDB.table('archive', cache_size=None)
+    # etm query, etm report and etm export only read the database
+    batch = len(sys.argv) > 1 and sys.argv[1] in ['query', 'report', 'export']
+    ETMDB = data.initialize_tinydb(dbfile, read_only=batch)
+    # writes to these tables are published to data.changes
+    DBITEM = data.FeedTable(ETMDB.table('items', cache_size=None), 'items')
+    DBARCH = data.FeedTable(ETMDB.table('archive', cache_size=None), 'archive')
     logger.debug(f"ETMDB: {ETMDB}")
 
     from etm.model import about
@@ -84,10 +88,35 @@ def main():
     model.settings = settings
     model.logger = logger
     # model.edit_file = os.path.join(etmdir, 'edit.text')
-    model.timers_file = os.path.join(etmdir, 'timers.pkl')
+    model.timers_file = os.path.join(etmdir, 'timers.log')
     userhome = os.path.expanduser('~')
     etmhome = os.path.join('~', os.path.relpath(etmdir, userhome)) if etmdir.startswith(userhome) else etmdir
     model.etmhome = etmhome
+
+    if batch:
+        # skip the dataview and the user interface
+        import etm.view as view
+        view.settings = settings
+        view.logger = logger
+        view.wrap = model.wrap
+        view.DBITEM = DBITEM
+        view.DBARCH = DBARCH
+        import etm.report as report
+        report.ETMQuery = view.ETMQuery
+        report.settings = settings
+        report.logger = logger
+        report.format_datetime = model.format_datetime
+        report.format_duration = model.format_duration
+        report.parse_duration = model.parse_duration
+        report.UT_MIN = settings.get('usedtime_minutes', 1)
+        if sys.argv[1] == 'export':
+            sys.exit(report.batch_export(sys.argv[2:], DBITEM, DBARCH))
+        sys.exit(report.batch(sys.argv[1], sys.argv[2:], DBITEM, DBARCH))
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        # import files without the dataview and the user interface
+        sys.exit(model.batch_import(sys.argv[2:]))
+
     # we put settings into the model namespace so model.Dataview will have it
     dataview = model.DataView(etmdir)
     datetime_calculator = model.datetime_calculator
@@ -179,6 +208,10 @@ def main():
             logger.info(f"calling data doctest with etmdir: {etmdir}, argv: {sys.argv}")
             import doctest
             doctest.testmod(data)
+        elif sys.argv[1] == 'ical':
+            logger.info(f"calling ical doctest with etmdir: {etmdir}, argv: {sys.argv}")
+            import doctest
+            doctest.testmod(ical)
         elif sys.argv[1] == 'rep':
             logger.info(f"calling report.main with etmdir: {etmdir}, argv: {sys.argv}")
             report.main(etmdir, sys.argv)
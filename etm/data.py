@@ -4,12 +4,23 @@ from tinydb import TinyDB, Query
 from tinydb import __version__ as tinydb_version
 from tinydb_serialization import Serializer
 from tinydb_serialization import SerializationMiddleware
+if tinydb_version >= '4.0.0':
+    from tinydb.table import Document
+else:
+    from tinydb.database import Document
 import base64  # for do_mask
+from copy import copy, deepcopy
+from bisect import bisect_left, bisect_right, insort
+from array import array
 import pendulum
 import dateutil
 import dateutil.rrule
 from dateutil.rrule import *
 import re
+import threading
+import logging
+# replaced in __main__
+logger = logging.getLogger('etm')
 
 ##########################
 ### begin TinyDB setup ###
@@ -213,18 +224,59 @@ class MaskSerializer(Serializer):
 ###### End Mask ########################
 ########################################
 
-def initialize_tinydb(dbfile):
+# the tags and serializers used for the database, in the order in which they are applied. DateTime must precede Date since it is a subclass.
+serializers = {
+        'T': PendulumDateTimeSerializer(),  # Time
+        'D': PendulumDateSerializer(),      # Date
+        'I': PendulumDurationSerializer(),  # Interval
+        'W': PendulumWeekdaySerializer(),   # Wkday
+        'M': MaskSerializer(),              # Mask
+        }
+
+def encode_value(obj):
+    """
+    Replace the objects in obj, recursively, with their '{tag}:serialization' strings as they are stored in the database file.
+    """
+    for tag, serializer in serializers.items():
+        if isinstance(obj, serializer.OBJ_CLASS):
+            return f"{{{tag}}}:{serializer.encode(obj)}"
+    if isinstance(obj, dict):
+        return {k: encode_value(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_value(x) for x in obj]
+    return obj
+
+def decode_value(obj):
+    """
+    The inverse of encode_value.
+    """
+    if isinstance(obj, str):
+        if len(obj) > 3 and obj[0] == '{' and obj[2:4] == '}:' and obj[1] in serializers:
+            return serializers[obj[1]].decode(obj[4:])
+        return obj
+    if isinstance(obj, dict):
+        return {k: decode_value(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [decode_value(x) for x in obj]
+    return obj
+
+def stored_value(obj):
     """
+    A copy of obj as it is read back from the database file. E.g., datetimes lose their seconds and are given in local time and tuples become lists.
+    """
+    return decode_value(encode_value(obj))
+
+def initialize_tinydb(dbfile, read_only=False):
+    """
+    With read_only and TinyDB 4, the file is opened for reading and any write will fail. TinyDB 3 has no access mode and passes unknown arguments on to json.dump, so read_only is ignored.
     """
     serialization = SerializationMiddleware()
-    serialization.register_serializer(PendulumDateTimeSerializer(), 'T') # Time
-    serialization.register_serializer(PendulumDateSerializer(), 'D')     # Date
-    serialization.register_serializer(PendulumDurationSerializer(), 'I') # Interval
-    serialization.register_serializer(PendulumWeekdaySerializer(), 'W')  # Wkday
-    serialization.register_serializer(MaskSerializer(), 'M')             # Mask
+    for tag, serializer in serializers.items():
+        serialization.register_serializer(serializer, tag)
     if tinydb_version >= '4.0.0':
+        access = {'access_mode': 'r'} if read_only else {}
         db = TinyDB(dbfile, storage=serialization,
-                indent=1, ensure_ascii=False)
+                indent=1, ensure_ascii=False, **access)
         db.default_table_name='items'
     else:
         db = TinyDB(dbfile, storage=serialization,
@@ -232,6 +284,462 @@ def initialize_tinydb(dbfile):
                 indent=1, ensure_ascii=False)
     return db
 
+class ChangeFeed():
+    """
+    A monotonically increasing database revision together with a feed of (doc_id, old, new) changes. old is None for inserts and new is None for removals. Subscribers are called with (revision, table_name, changes) after every write.
+    """
+
+    def __init__(self):
+        self.revision = 0
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def publish(self, name, changes):
+        if not changes:
+            return
+        self.revision += 1
+        for callback in self.subscribers:
+            try:
+                callback(self.revision, name, changes)
+            except Exception as e:
+                logger.error(f"change feed subscriber {callback} failed for revision {self.revision}: {repr(e)}")
+
+changes = ChangeFeed()
+
+
+def copy_document(doc):
+    """
+    Return a copy of doc that can be modified, e.g., by the update commands in ETMQuery, without changing doc itself. Only top level lists and dicts are copied.
+    """
+    return Document({k: copy(v) if isinstance(v, (list, dict)) else v for k, v in doc.items()}, doc.doc_id)
+
+
+def used_minutes(period, UT_MIN=1):
+    """
+    The whole minutes in period rounded up to a multiple of UT_MIN.
+    >>> used_minutes(pendulum.duration(hours=1, minutes=5), 6)
+    66
+    """
+    minutes = int(period.total_seconds()) // 60
+    if UT_MIN != 1:
+        minutes = -(-minutes // UT_MIN) * UT_MIN
+    return minutes
+
+
+def minute_stamp(dt):
+    """
+    The number of minutes from 0001-01-01 to dt, a date or datetime, using the wall clock time of dt. Dates are taken at 00:00. Minute stamps compare as report.earlier and report.later compare dates and datetimes.
+    """
+    if isinstance(dt, pendulum.DateTime):
+        return dt.toordinal() * 1440 + dt.hour * 60 + dt.minute
+    return dt.toordinal() * 1440
+
+
+class UsedTimes():
+    """
+    A columnar store of the @u entries in a table: parallel integer arrays of the minute stamps of the entries, their doc_ids and their whole minutes ordered by minute stamp. Aggregations over a range of datetimes then read a slice of these arrays rather than the durations and datetimes in the documents.
+    """
+
+    def __init__(self):
+        self.stamps = array('q')
+        self.ids = array('q')
+        self.minutes = array('q')
+
+    def __len__(self):
+        return len(self.stamps)
+
+    @staticmethod
+    def entries(used):
+        for entry in used:
+            try:
+                period, dt = entry
+                yield minute_stamp(dt), used_minutes(period)
+            except Exception as e:
+                logger.warning(f"skipping the @u entry {entry}: {e}")
+
+    def load(self, used):
+        """
+        Replace the entries with those in used, a list of (doc_id, @u entries) pairs, sorting them just once.
+        """
+        rows = sorted(((stamp, doc_id, minutes) for doc_id, entries in used for stamp, minutes in self.entries(entries)), key=lambda x: x[0])
+        self.stamps = array('q', [x[0] for x in rows])
+        self.ids = array('q', [x[1] for x in rows])
+        self.minutes = array('q', [x[2] for x in rows])
+
+    def add(self, doc_id, used):
+        for stamp, minutes in self.entries(used):
+            i = bisect_right(self.stamps, stamp)
+            self.stamps.insert(i, stamp)
+            self.ids.insert(i, doc_id)
+            self.minutes.insert(i, minutes)
+
+    def discard(self, doc_id, used):
+        for stamp, minutes in self.entries(used):
+            for i in range(bisect_left(self.stamps, stamp), bisect_right(self.stamps, stamp)):
+                if self.ids[i] == doc_id and self.minutes[i] == minutes:
+                    del self.stamps[i]
+                    del self.ids[i]
+                    del self.minutes[i]
+                    break
+
+    def totals(self, begin=None, end=None, doc_ids=None, UT_MIN=1):
+        """
+        Return {(doc_id, day ordinal): minutes} for the entries with begin <= minute stamp <= end and, if given, doc_id in doc_ids. Each entry is rounded up to a multiple of UT_MIN before summing.
+        """
+        i = 0 if begin is None else bisect_left(self.stamps, begin)
+        j = len(self.stamps) if end is None else bisect_right(self.stamps, end)
+        ret = {}
+        for stamp, doc_id, minutes in zip(self.stamps[i:j], self.ids[i:j], self.minutes[i:j]):
+            if doc_ids is not None and doc_id not in doc_ids:
+                continue
+            if UT_MIN != 1:
+                minutes = -(-minutes // UT_MIN) * UT_MIN
+            key = (doc_id, stamp // 1440)
+            ret[key] = ret.get(key, 0) + minutes
+        return ret
+
+
+def fingerprint(hsh):
+    """
+    The (itemtype, summary, s) key used to recognize duplicate reminders. Case and runs of whitespace in the summary are ignored and aware datetimes are compared as timestamps.
+    """
+    summary = hsh.get('summary')
+    if isinstance(summary, str):
+        summary = " ".join(summary.split()).casefold()
+    s = hsh.get('s')
+    if isinstance(s, pendulum.DateTime):
+        s = ('T', s.timestamp()) if s.tzinfo is not None else ('N', s.isoformat())
+    elif isinstance(s, pendulum.Date):
+        s = ('D', s.isoformat())
+    elif s is not None:
+        s = ('?', str(s))
+    return (hsh.get('itemtype'), summary, s)
+
+
+class TableIndex():
+    """
+    An in memory copy of the documents in a table together with indexes for the keys present, the values of selected fields, the year, month and day of selected date fields, the words in selected text fields, the @u entries and the fingerprints used to recognize duplicates. The indexes provide candidate doc_ids for queries so that only these documents need to be tested.
+    """
+
+    value_fields = ['itemtype', 'i', 'l', 'c']
+    list_fields = ['t']
+    date_fields = ['s', 'f', 'created', 'modified']
+    text_fields = ['summary', 'd', 'l', 'i', 'c', 't']
+
+    def __init__(self):
+        self.docs = {}
+        self.keys = {}
+        self.values = {x: {} for x in self.value_fields + self.list_fields}
+        self.dates = {x: [] for x in self.date_fields}
+        # term -> doc_ids and the sorted terms for each text field
+        self.terms = {x: {} for x in self.text_fields}
+        self.vocab = {x: [] for x in self.text_fields}
+        self.used = UsedTimes()
+        self.fingerprints = {}
+
+    @staticmethod
+    def tokens(value):
+        """
+        The set of lower case words in value, a string or a list of strings.
+        """
+        words = set()
+        for x in (value if isinstance(value, list) else [value]):
+            if isinstance(x, str):
+                words.update(word_regex.findall(x.lower()))
+        return words
+
+    def load(self, docs):
+        # the @u entries are added together rather than inserted one at a time
+        used = []
+        for doc in docs:
+            self.add(doc, with_used=False)
+            if isinstance(doc.get('u'), list):
+                used.append((doc.doc_id, doc['u']))
+        self.used.load(used)
+
+    def add(self, doc, with_used=True):
+        doc_id = doc.doc_id
+        if doc_id in self.docs:
+            self.discard(doc_id)
+        self.docs[doc_id] = doc
+        self.fingerprints.setdefault(fingerprint(doc), set()).add(doc_id)
+        if with_used and isinstance(doc.get('u'), list):
+            self.used.add(doc_id, doc['u'])
+        for key, value in doc.items():
+            self.keys.setdefault(key, set()).add(doc_id)
+            if key in self.values:
+                for x in (value if isinstance(value, list) else [value]):
+                    try:
+                        self.values[key].setdefault(x, set()).add(doc_id)
+                    except TypeError:
+                        # unhashable
+                        pass
+            if key in self.dates and isinstance(value, pendulum.Date):
+                insort(self.dates[key], ((value.year, value.month, value.day), doc_id))
+            if key in self.terms:
+                for term in self.tokens(value):
+                    ids = self.terms[key].get(term)
+                    if ids is None:
+                        ids = self.terms[key][term] = set()
+                        insort(self.vocab[key], term)
+                    ids.add(doc_id)
+
+    def discard(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        key = fingerprint(doc)
+        ids = self.fingerprints.get(key)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del self.fingerprints[key]
+        if isinstance(doc.get('u'), list):
+            self.used.discard(doc_id, doc['u'])
+        for key, value in doc.items():
+            if doc_id in self.keys.get(key, ()):
+                self.keys[key].discard(doc_id)
+                if not self.keys[key]:
+                    del self.keys[key]
+            if key in self.values:
+                for x in (value if isinstance(value, list) else [value]):
+                    try:
+                        ids = self.values[key].get(x, set())
+                    except TypeError:
+                        continue
+                    ids.discard(doc_id)
+                    if not ids and x in self.values[key]:
+                        del self.values[key][x]
+            if key in self.dates and isinstance(value, pendulum.Date):
+                entry = ((value.year, value.month, value.day), doc_id)
+                i = bisect_left(self.dates[key], entry)
+                if i < len(self.dates[key]) and self.dates[key][i] == entry:
+                    del self.dates[key][i]
+            if key in self.terms:
+                for term in self.tokens(value):
+                    ids = self.terms[key].get(term)
+                    if ids is None:
+                        continue
+                    ids.discard(doc_id)
+                    if not ids:
+                        del self.terms[key][term]
+                        i = bisect_left(self.vocab[key], term)
+                        if i < len(self.vocab[key]) and self.vocab[key][i] == term:
+                            del self.vocab[key][i]
+
+    def with_key(self, key):
+        return set(self.keys.get(key, ()))
+
+    def with_value(self, field, value):
+        """
+        doc_ids for which the value of field, or an element of the value if it is a list, equals value.
+        """
+        try:
+            return set(self.values[field].get(value, ()))
+        except TypeError:
+            return set()
+
+    def in_dates(self, field, begin, end):
+        """
+        doc_ids for which begin <= (year, month, day) of the value of field < end.
+        """
+        lst = self.dates[field]
+        i = bisect_left(lst, (begin, ))
+        j = bisect_left(lst, (end, ))
+        return set(x[1] for x in lst[i:j])
+
+    def with_fingerprint(self, hsh):
+        """
+        doc_ids for which the fingerprint equals that of hsh.
+        """
+        return set(self.fingerprints.get(fingerprint(hsh), ()))
+
+    def with_prefix(self, field, prefix):
+        """
+        doc_ids for which the value of the text field contains a word beginning with the lower case string prefix.
+        """
+        lst = self.vocab[field]
+        ids = set()
+        i = bisect_left(lst, prefix)
+        while i < len(lst) and lst[i].startswith(prefix):
+            ids |= self.terms[field][lst[i]]
+            i += 1
+        return ids
+
+    def with_part(self, field, part):
+        """
+        doc_ids for which the value of the text field contains a word including the lower case string part. Only the distinct words are scanned, not the documents.
+        """
+        ids = set()
+        for term in self.vocab[field]:
+            if part in term:
+                ids |= self.terms[field][term]
+        return ids
+
+
+class FeedTable():
+    """
+    Wrap a TinyDB table so that every insert, update and remove is published to the change feed and reflected in the table index. Everything else is passed through to the table.
+    """
+
+    def __init__(self, table, name, feed=None):
+        self.table = table
+        self.name = name
+        self.feed = feed if feed is not None else changes
+        self._index = None
+        # held while the index is being loaded so that other callers wait
+        # for that load rather than starting another
+        self._loading = threading.Lock()
+        # guards _pending, the changes made while the index is being loaded
+        self._pending_lock = threading.Lock()
+        self._pending = None
+
+    @property
+    def index(self):
+        """
+        The TableIndex for this table, loaded on first use and thereafter kept current by the writes below. The load may run in an executor thread - the index is only made available once it is complete and includes any changes made in the meantime.
+        """
+        if self._index is None:
+            with self._loading:
+                if self._index is None:
+                    with self._pending_lock:
+                        self._pending = []
+                    index = TableIndex()
+                    index.load(self.table.all())
+                    with self._pending_lock:
+                        for changed in self._pending:
+                            self._apply(index, changed)
+                        self._index = index
+                        self._pending = None
+        return self._index
+
+    @property
+    def loaded(self):
+        return self._index is not None
+
+    @staticmethod
+    def _apply(index, changed):
+        for doc_id, new in changed:
+            if new is None:
+                index.discard(doc_id)
+            else:
+                index.add(new)
+
+    def _reindex(self, changed):
+        with self._pending_lock:
+            if self._index is None and self._pending is None:
+                # neither loaded nor loading
+                return
+        # a private copy, unaffected by later changes to the caller's dict, of what is stored
+        changed = [(doc_id, None if new is None else Document(stored_value(dict(new)), doc_id)) for doc_id, old, new in changed]
+        with self._pending_lock:
+            if self._index is None:
+                # applied when the load is complete
+                self._pending.append(changed)
+                return
+        self._apply(self._index, changed)
+
+    def __getattr__(self, attr):
+        return getattr(self.table, attr)
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __repr__(self):
+        return f"FeedTable({self.name}, revision={self.feed.revision})"
+
+    def _docs(self, cond=None, doc_ids=None):
+        # from the index when loaded, else a single read whatever the number of doc_ids
+        if self._index is not None:
+            docs = self._index.docs
+            if doc_ids is not None:
+                return [docs[x] for x in doc_ids if x in docs]
+            if cond is not None:
+                return [doc for doc in docs.values() if cond(doc)]
+            return list(docs.values())
+        if doc_ids is not None:
+            if len(doc_ids) == 1:
+                doc = self.table.get(doc_id=doc_ids[0])
+                return [doc] if doc is not None else []
+            ids = set(doc_ids)
+            return [doc for doc in self.table.all() if doc.doc_id in ids]
+        if cond is not None:
+            return self.table.search(cond)
+        return self.table.all()
+
+    def insert(self, doc):
+        doc_id = self.table.insert(doc)
+        changed = [(doc_id, None, Document(dict(doc), doc_id))]
+        self._reindex(changed)
+        self.feed.publish(self.name, changed)
+        return doc_id
+
+    def insert_multiple(self, docs):
+        docs = list(docs)
+        doc_ids = self.table.insert_multiple(docs)
+        changed = [(doc_id, None, Document(dict(doc), doc_id)) for doc_id, doc in zip(doc_ids, docs)]
+        self._reindex(changed)
+        self.feed.publish(self.name, changed)
+        return doc_ids
+
+    def update(self, fields, cond=None, doc_ids=None):
+        olds = self._docs(cond, doc_ids)
+        ret = self.table.update(fields, cond=cond, doc_ids=doc_ids)
+        changed = []
+        for old in olds:
+            new = Document(dict(old), old.doc_id)
+            if callable(fields):
+                fields(new)
+            else:
+                new.update(fields)
+            changed.append((old.doc_id, old, new))
+        self._reindex(changed)
+        self.feed.publish(self.name, changed)
+        return ret
+
+    def write_back(self, docs):
+        """
+        Replace the stored documents with docs, each a Document, using a single write to the table and a single publication to the feed.
+        """
+        docs = list(docs)
+        olds = {doc.doc_id: doc for doc in self._docs(doc_ids=[doc.doc_id for doc in docs])}
+        docs = [doc for doc in docs if doc.doc_id in olds]
+        if not docs:
+            return []
+        news = iter(docs)
+
+        def replace(doc):
+            # TinyDB applies the update to the doc_ids in the order given
+            new = next(news)
+            doc.clear()
+            doc.update(new)
+
+        doc_ids = [doc.doc_id for doc in docs]
+        self.table.update(replace, doc_ids=doc_ids)
+        changed = [(doc.doc_id, olds[doc.doc_id], Document(dict(doc), doc.doc_id)) for doc in docs]
+        self._reindex(changed)
+        self.feed.publish(self.name, changed)
+        return doc_ids
+
+    def remove(self, cond=None, doc_ids=None):
+        olds = self._docs(cond, doc_ids)
+        ret = self.table.remove(cond=cond, doc_ids=doc_ids)
+        changed = [(old.doc_id, old, None) for old in olds]
+        self._reindex(changed)
+        self.feed.publish(self.name, changed)
+        return ret
+
+
 def format_duration(obj):
     """
     >>> td = pendulum.duration(weeks=1, days=2, hours=3, minutes=27)
@@ -270,6 +778,7 @@ def format_duration_list(obj_lst):
 period_regex = re.compile(r'(([+-]?)(\d+)([wdhm]))+?')
 threeday_regex = re.compile(r'(MON|TUE|WED|THU|FRI|SAT|SUN)', re.IGNORECASE)
 anniversary_regex = re.compile(r'!(\d{4})!')
+word_regex = re.compile(r'\w+')
 
 period_hsh = dict(
     z=pendulum.duration(seconds=0),
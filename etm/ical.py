@@ -1,6 +1,6 @@
 import os
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 from icalendar import Calendar, Event, Todo, Journal
 from icalendar.caselessdict import CaselessDict
@@ -43,6 +43,23 @@ def pen_from_fmt(s, z='local'):
             dt = dt.date()
         return dt
 
+def pen_from_ical(value):
+    """
+    The pendulum Date or DateTime for value, a date or datetime decoded from an ics property. Aware datetimes, including UTC times ending in 'Z', are converted to the local timezone. Naive (floating) datetimes are returned as naive.
+    >>> pen_from_ical(vDatetime.from_ical("20261020T090000Z")).in_timezone('UTC')
+    DateTime(2026, 10, 20, 9, 0, 0, tzinfo=Timezone('UTC'))
+    >>> pen_from_ical(vDatetime.from_ical("20261020T090000"))
+    DateTime(2026, 10, 20, 9, 0, 0)
+    >>> pen_from_ical(vDate.from_ical("20261020"))
+    Date(2026, 10, 20)
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return pendulum.naive(value.year, value.month, value.day, value.hour, value.minute, value.second)
+        return pendulum.from_timestamp(value.timestamp()).in_timezone('local')
+    return pendulum.date(value.year, value.month, value.day)
+
+
 def fmt_dt(s):
     dt = parse(s)
     return dt.strftime("%Y-%m-%d %H:%M")
@@ -143,13 +160,6 @@ ical_freq_hsh = {
     # 'EASTERLY': 'e'
 }
 
-item_types = {
-        '*': Event(),
-        '-': Todo(),
-        '%': Journal()
-        }
-
-
 # BEGIN:VCALENDAR
 # VERSION:2.0
 # PRODID:-//etm_tk 3.2.38//dgraham.us//
@@ -162,6 +172,140 @@ item_types = {
 # END:VCALENDAR
  
 
+def component_to_item(comp):
+    """
+    Return the item hash corresponding to the VEVENT, VTODO or VJOURNAL component comp or None for other components.
+    >>> from etm.data import Document
+    >>> s = pendulum.datetime(2026, 10, 20, 9, 30, tz='local')
+    >>> doc = Document({'itemtype': '*', 'summary': 'lunch', 's': s, 'e': pendulum.duration(hours=1)}, 1)
+    >>> ok, element = item_to_ics(doc)
+    >>> item = component_to_item(Calendar.from_ical(element.to_ical()))
+    >>> item['summary'], item['s'] == s, item['e']
+    ('lunch', True, Duration(hours=1))
+    """
+    item = {}
+    start = None
+    t = ''  # item type
+    s = ''  # @s
+    e = ''  # @e
+    f = ''  # @f
+    tzid = comp.get('tzid')
+    if comp.name == "VEVENT":
+        t = '*'
+        start = comp.get('dtstart')
+        if start:
+            s = comp.decoded('dtstart')
+            if comp.get('dtend'):
+                end = comp.decoded('dtend')
+                logger.debug(f"start: {s}, end: {end}")
+                e = pendulum.duration(seconds=int((end - s).total_seconds()))
+
+    elif comp.name == "VTODO":
+        t = '-'
+        if comp.get('completed'):
+            f = comp.decoded('completed')
+        start = comp.get('dtstart')
+        if comp.get('due'):
+            s = comp.decoded('due')
+        elif start:
+            s = comp.decoded('dtstart')
+
+    elif comp.name == "VJOURNAL":
+        t = '%'
+        if comp.get('dtstart'):
+            s = comp.decoded('dtstart')
+    else:
+        return None
+    if t == '*' and not s:
+        raise ValueError("missing or invalid DTSTART")
+    item['itemtype'] = t
+    tmp = comp.get('summary')
+    if tmp:
+        item['summary'] = tmp.to_ical().decode('utf-8')
+    if start and 'TZID' in start.params:
+        logger.debug("TZID: {0}".format(start.params['TZID']))
+        item['z'] = start.params['TZID']
+    if s:
+        item['s'] = pen_from_ical(s)
+    if e:
+        item['e'] = e
+    if f:
+        item['f'] = pen_from_ical(f)
+    tzid = comp.get('tzid')
+    if tzid:
+        logger.debug("Using tzid: {0}".format(tzid.to_ical().decode('utf-8')))
+        item['z'] = tzid
+    else:
+        logger.debug("Using tzid: {0}".format(local_timezone))
+        if local_timezone:
+            item['z'] = local_timezone
+    if isinstance(item.get('s'), pendulum.DateTime) and item['s'].tzinfo is None:
+        # a floating time
+        item['z'] = 'float'
+
+    tmp = comp.get('description')
+    if tmp:
+        desc = tmp.to_ical().decode('utf-8').replace('\,', ',').replace('\;', ';').replace('\\n', '\n')
+        item['d'] = "".join(desc) if isinstance(desc, list) else desc
+    tmp = comp.get('organizer')
+    if tmp:
+        item['w'] =  tmp.to_ical().decode('utf-8')
+
+    rule = comp.get('rrule')
+    if rule:
+        rhsh = {}
+        keys = rule.sorted_keys()
+        for key in keys:
+            if key == 'FREQ':
+                rhsh['r'] = ical_freq_hsh[rule.get('FREQ')[0].to_ical().decode('utf-8')]
+            elif key == 'UNTIL':
+                tmp = rule.get(key)
+                rhsh['u'] = pen_from_ical(tmp[0])
+            elif key == 'BYDAY':
+                tmp = rule.get(key)
+                rhsh['w'] = [wkdays_decode(x) for x in tmp]
+            elif key in ical_rrule_hsh:
+                tmp = rule.get(key) #.to_ical().decode('utf-8')
+                if not isinstance(tmp, list):
+                    tmp = [x.strip() for x in tmp.split(',')]
+                rhsh[ical_rrule_hsh[key]] = tmp
+        item.setdefault('r', []).append(rhsh)
+
+    tags = comp.get('categories')
+    if tags:
+        if type(tags) is not list:
+            tags = [tags]
+        tags = [x.to_ical().decode('utf-8') for x in tags]
+        item['t'] = tags
+
+    invitees = comp.get('attendee')
+    if invitees:
+        tmp = []
+        if type(invitees) is not list:
+            invitees = [invitees]
+        invitees = [x.to_ical().decode('utf-8') for x in invitees]
+        for x in invitees:
+            if x.startswith("MAILTO:"):
+                x = x[7:]
+            tmp.append(x)
+        item['n'] = tmp
+
+    rdates = comp.get('rdate')
+    if rdates:
+        if type(rdates) is not list:
+            rdates = [rdates]
+        rdates = [pen_from_ical(dt.dt) for x in rdates for dt in x.dts]
+        item['+'] = rdates
+
+    exdates = comp.get('exdate')
+    if exdates:
+        if type(exdates) is not list:
+            exdates = [exdates]
+        exdates = [pen_from_ical(dt.dt) for x in exdates for dt in x.dts]
+        item['-'] = exdates
+    return item
+
+
 def ics_to_items(ics_file=None):
     """
     Process an ics (iCalendar) file and return a corresponding hash of item hashes suitable for adding to tinydb.
@@ -171,136 +315,59 @@ def ics_to_items(ics_file=None):
         return False, f"Could not open {ics_file}"
     with open(ics_file, 'rb') as g:
         cal = Calendar.from_ical(g.read())
-    ilst = []
     items = {}
     id = 0
     for comp in cal.walk():
-        item = {}
-        start = None
-        t = ''  # item type
-        s = ''  # @s
-        e = ''  # @e
-        f = ''  # @f
-        tzid = comp.get('tzid')
-        if comp.name == "VEVENT":
-            t = '*'
-            start = comp.get('dtstart')
-            if start:
-                s = start.to_ical().decode('utf-8')[:16]
-                end = comp.get('dtend')
-                if end:
-                    e = end.to_ical().decode('utf-8')[:16]
-                    logger.debug('start: {0}, s: {1}, end: {2}, e: {3}'.format(start, s, end, e))
-                    extent = parse(e) - parse(s)
-                    e = extent
-
-        elif comp.name == "VTODO":
-            t = '-'
-            tmp = comp.get('completed')
-            if tmp:
-                f = tmp.to_ical().decode('utf-8')[:16]
-            due = comp.get('due')
-            start = comp.get('dtstart')
-            if due:
-                s = due.to_ical().decode('utf-8')
-            elif start:
-                s = start.to_ical().decode('utf-8')
-
-        elif comp.name == "VJOURNAL":
-            t = '%'
-            tmp = comp.get('dtstart')
-            if tmp:
-                s = tmp.to_ical().decode('utf-8')[:16]
-        else:
+        try:
+            item = component_to_item(comp)
+        except Exception as e:
+            logger.error(f"skipping {comp.name} {comp.get('summary', '')} in {ics_file}: {e}")
+            continue
+        if item is None:
             continue
         id += 1
-        item['itemtype'] = t
-        tmp = comp.get('summary')
-        if tmp:
-            item['summary'] = tmp.to_ical().decode('utf-8')
-        if start and 'TZID' in start.params:
-            logger.debug("TZID: {0}".format(start.params['TZID']))
-            item['z'] = start.params['TZID']
-        if s:
-            item['s'] = pen_from_fmt(s)
-        if e:
-            item['e'] = e
-        if f:
-            item['f'] = pen_from_fmt(f)
-        tzid = comp.get('tzid')
-        if tzid:
-            logger.debug("Using tzid: {0}".format(tzid.to_ical().decode('utf-8')))
-            item['z'] = tzid
-        else:
-            logger.debug("Using tzid: {0}".format(local_timezone))
-            if local_timezone:
-                item['z'] = local_timezone
-
-        tmp = comp.get('description')
-        if tmp:
-            desc = tmp.to_ical().decode('utf-8').replace('\,', ',').replace('\;', ';').replace('\\n', '\n')
-            item['d'] = "".join(desc) if isinstance(desc, list) else desc
-        tmp = comp.get('organizer')
-        if tmp:
-            item['w'] =  tmp.to_ical().decode('utf-8')
-
-        rule = comp.get('rrule')
-        if rule:
-            rhsh = {}
-            keys = rule.sorted_keys()
-            for key in keys:
-                if key == 'FREQ':
-                    rhsh['r'] = ical_freq_hsh[rule.get('FREQ')[0].to_ical().decode('utf-8')]
-                elif key == 'UNTIL':
-                    tmp = rule.get(key)
-                    rhsh['u'] = pen_from_fmt(tmp[0])
-                elif key == 'BYDAY':
-                    tmp = rule.get(key)
-                    rhsh['w'] = wkdays_decode(tmp[0])
-                elif key in ical_rrule_hsh:
-                    tmp = rule.get(key) #.to_ical().decode('utf-8')
-                    if not isinstance(tmp, list):
-                        tmp = [x.strip() for x in tmp.split(',')]
-                    rhsh[ical_rrule_hsh[key]] = tmp
-            item.setdefault('r', []).append(rhsh)
-
-        tags = comp.get('categories')
-        if tags:
-            if type(tags) is not list:
-                tags = [tags]
-            tags = [x.to_ical().decode('utf-8') for x in tags]
-            item['t'] = tags
-
-        invitees = comp.get('attendee')
-        if invitees:
-            tmp = []
-            if type(invitees) is not list:
-                invitees = [invitees]
-            invitees = [x.to_ical().decode('utf-8') for x in invitees]
-            for x in invitees:
-                if x.startswith("MAILTO:"):
-                    x = x[7:]
-                tmp.append(x)
-            item['n'] = tmp
-
-        rdates = comp.get('rdate')
-        if rdates:
-            if type(rdates) is not list:
-                rdates = [rdates]
-            rdates = [pen_from_fmt(x.to_ical().decode('utf-8')[:16]) for x in rdates]
-            item['+'] = rdates
-
-        exdates = comp.get('exdate')
-        if exdates:
-            if type(exdates) is not list:
-                exdates = [exdates]
-            exdates = [pen_from_fmt(x.to_ical().decode('utf-8')[:16]) for x in exdates]
-            item['-'] = exdates
-
-        # items[f"{id}"] = item
         items[id] = item
     return items
 
+
+component_names = [b'VEVENT', b'VTODO', b'VJOURNAL']
+
+def iter_ics_components(ics_file):
+    """
+    Read ics_file a line at a time and generate the VEVENT, VTODO and VJOURNAL components one at a time so that only a single component is held in memory. Components that cannot be parsed are logged and skipped.
+    """
+    lines = []
+    name = None
+    with open(ics_file, 'rb') as fo:
+        for line in fo:
+            if name is None:
+                if line.startswith(b'BEGIN:') and line[6:].strip().upper() in component_names:
+                    name = line[6:].strip().upper()
+                    lines = [line]
+                continue
+            lines.append(line)
+            if line.startswith(b'END:') and line[4:].strip().upper() == name:
+                try:
+                    yield Calendar.from_ical(b"".join(lines))
+                except Exception as e:
+                    logger.error(f"skipping {name.decode()} in {ics_file}: {e}")
+                name = None
+                lines = []
+
+
+def iter_ics_items(ics_file):
+    """
+    Generate the item hashes for the components in ics_file as they are read. Components that cannot be converted are logged and skipped.
+    """
+    for comp in iter_ics_components(ics_file):
+        try:
+            item = component_to_item(comp)
+        except Exception as e:
+            logger.error(f"skipping {comp.name} {comp.get('summary', '')} in {ics_file}: {e}")
+            continue
+        if item is not None:
+            yield item
+
 # def ics_to_text(ics=None):
 #     """
 #     Convert an ics (iCalendar) file to corresponding list of etm text entries and return a tuple (Success, string list)
@@ -434,6 +501,43 @@ def ics_to_items(ics_file=None):
 #         ilst.append(item)
 #     return ilst
 
+# etm rrule keys other than r (FREQ), u (UNTIL) and w (BYDAY)
+ical_rrule_parts = {
+    'i': 'INTERVAL',
+    'c': 'COUNT',
+    's': 'BYSETPOS',
+    'M': 'BYMONTH',
+    'm': 'BYMONTHDAY',
+    'W': 'BYWEEKNO',
+    'h': 'BYHOUR',
+    'n': 'BYMINUTE',
+}
+
+ical_components = {
+        '*': Event,
+        '-': Todo,
+        '!': Todo,
+        '%': Journal,
+        }
+
+
+def ical_datetime(dt):
+    """
+    Aware datetimes are given in UTC using pytz so that they are serialized as UTC times ending in 'Z' without a TZID. Dates and naive (floating) datetimes are unchanged.
+    """
+    if isinstance(dt, pendulum.DateTime) and dt.tzinfo is not None:
+        return datetime.fromtimestamp(dt.timestamp(), pytz.utc)
+    return dt
+
+
+def ical_weekday(wd):
+    """
+    The BYDAY string for the dateutil weekday wd, e.g., '-3MO' for MO(-3).
+    """
+    name = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'][wd.weekday]
+    return f"{wd.n}{name}" if wd.n else name
+
+
 def item_to_ics(item):
     """
     Convert an etm item to an ical object and return a tuple (Success, object)
@@ -441,110 +545,53 @@ def item_to_ics(item):
     doc_id = item.doc_id
     if not doc_id:
         return False, None
-    itemtype = item.get('itemtype')
-    if not itemtype:
-        return False, None
-    element = item_types.get(itemtype) 
-    if not element:
+    component = ical_components.get(item.get('itemtype'))
+    if not component or not item.get('summary'):
         return False, None
-    summary = item['summary']
-
-    element.add('uid', doc_id)
-    if 'z' in item:
-        # pytz is required to get the proper tzid into datetimes
-        tz = pytz.timezone(item['z'])
-    else:
-        tz = None
-    if 's' in item:
-        dt = item['s']
-        dz = dt.replace(tzinfo=tz)
-        tzinfo = dz.tzinfo
-        dt = dz
-        dd = dz.date()
-    else:
-        dt = None
-        tzinfo = None
-        # tzname = None
+    element = component()
+    element.add('uid', f"{doc_id}")
+    element.add('summary', item['summary'])
 
+    dt = ical_datetime(item['s']) if 's' in item else None
+    if item['itemtype'] == '*':
+        if dt is None:
+            return False, None
+        element.add('dtstart', dt)
+        if item.get('e') and isinstance(dt, datetime):
+            element.add('dtend', dt + item['e'])
+    elif item['itemtype'] in ['-', '!']:
+        if dt is not None:
+            element.add('due', dt)
+        if 'f' in item:
+            element.add('completed', ical_datetime(item['f']))
+    elif dt is not None:
+        element.add('dtstart', dt)
+
+    for rul in item.get('r', []):
+        if rul.get('r') not in freq_hsh:
+            continue
+        rrule = {'FREQ': freq_hsh[rul['r']]}
+        for key, part in ical_rrule_parts.items():
+            if key in rul:
+                rrule[part] = rul[key]
+        if 'u' in rul:
+            rrule['UNTIL'] = ical_datetime(rul['u'])
+        if 'w' in rul:
+            wds = rul['w'] if isinstance(rul['w'], list) else [rul['w']]
+            rrule['BYDAY'] = [ical_weekday(x) for x in wds]
+        element.add('rrule', CaselessDict(rrule))
     if 'r' in item:
-        # repeating
-        rlst = item['r']
-        for r in rlst:
-            ritem = {}
-            for k in ical_rrule_keys:
-                if k in r:
-                    if k == 'f':
-                        ritem[ical_item[k]] = freq_item[r[k]]
-                    elif k == 'w':
-                        if type(r[k]) == list:
-                            ritem[ical_item[k]] = [x.upper() for x in r[k]]
-                        else:
-                            ritem[ical_item[k]] = r[k].upper()
-                    elif k == 'u':
-                        uz = parse_str(r[k], item['z']).replace(tzinfo=tzinfo)
-                        ritem[ical_item[k]] = uz
-                    else:
-                        ritem[ical_item[k]] = r[k]
-            citem = CaselessDict(ritem)
-            element.add('rrule', citem)
-        if '+' in item:
-            for pd in item['+']:
-                element.add('rdate', pd)
-        if '-' in item:
-            for md in item['-']:
-                element.add('exdate', md)
-
-    element.add('summary', summary)
-
-    if 'p' in item:
-        element.add('priority', item['p'])
+        for dt in item.get('+', []):
+            element.add('rdate', ical_datetime(dt))
+        for dt in item.get('-', []):
+            element.add('exdate', ical_datetime(dt))
+
     if 'l' in item:
         element.add('location', item['l'])
     if 't' in item:
         element.add('categories', item['t'])
     if 'd' in item:
         element.add('description', item['d'])
-    if 'm' in item:
-        element.add('comment', item['m'])
-    if 'w' in item:
-        element.add('organizer', item['w'])
-    if 'i' in item:
-        for x in item['i']:
-            element.add('attendee', "MAILTO:{0}".format(x))
-
-
-    if item['itemtype'] in ['-', '+', '%']:
-        done, due, following = getDoneAndTwo(item)
-        if 's' in item:
-            element.add('dtstart', dt)
-        if done:
-            finz = done.replace(tzinfo=tzinfo)
-            fint = vDatetime(finz)
-            element.add('completed', fint)
-        if due:
-            duez = due.replace(tzinfo=tzinfo)
-            dued = vDate(duez)
-            element.add('due', dued)
-    elif item['itemtype'] == '^':
-        element.add('dtstart', dd)
-    elif dt:
-        try:
-            element.add('dtstart', dt)
-        except:
-            logger.exception('exception adding dtstart: {0}'.format(dt))
-
-    if item['itemtype'] == '*':
-        if 'e' in item and item['e']:
-            ez = dz + item['e']
-        else:
-            ez = dz
-        try:
-            element.add('dtend', ez)
-        except:
-            logger.exception('exception adding dtend: {0}, {1}'.format(ez, tz))
-    elif item['itemtype'] == '~':
-        if 'e' in item and item['e']:
-            element.add('comment', timedelta2Str(item['e']))
     return True, element
 
 
@@ -581,65 +628,71 @@ def export_item_to_ics(hsh, ics_file):
     return True
 
 
-def export_active_to_ics(file2uuids, uuid2hash, ics_file, calendars=None):
+class ICSExporter():
     """
-    Export items from active calendars to an ics file with the same name in vcal_folder.
+    Export the items in a table to an ics file. The serialized VEVENT, VTODO or VJOURNAL for each item is cached together with the document it was made from. Since a write to the table replaces the document in the table index, only items added or changed since the last export are serialized again and, if nothing has changed, the file is not rewritten. The file is written a component at a time to a temporary file which then replaces ics_file.
     """
-    logger.debug("ics_file: {0}; calendars: {1}".format(ics_file, calendars))
 
-    calendar = Calendar()
-    calendar.add('prodid', '-//etm//dgraham.us//'.format(version))
-    calendar.add('version', '2.0')
+    header = b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//etm//dgraham.us//\r\n"
+    footer = b"END:VCALENDAR\r\n"
 
-    cal_tuples = []
-    if calendars:
-        for cal in calendars:
-            logger.debug('processing cal: {0}'.format(cal))
-            if not cal[1]:
-                continue
-            name = cal[0]
-            regex = re.compile(r'^{0}'.format(cal[2]))
-            cal_tuples.append((name, regex))
-    else:
-        logger.debug('processing cal: all')
-        regex = re.compile(r'^.*')
-        cal_tuples.append(('all', regex))
-
-    if not cal_tuples:
-        return
-
-    logger.debug('using cal_tuples: {0}'.format(cal_tuples))
-    match = False
-    for rp in file2uuids:
-        for name, regex in cal_tuples:
-            if regex.match(rp):
-                for uid in file2uuids[rp]:
-                    this_hsh = uuid2hash[uid]
-                    ok, element = item_to_ics(this_hsh)
-                    if ok:
-                        calendar.add_component(element)
-                break
-        if not match:
-            logger.debug('skipping {0} - no match in calendars'.format(rp))
+    def __init__(self, table, ics_file):
+        self.table = table
+        self.ics_file = ics_file
+        self.cache = {}     # doc_id -> (doc, serialized component)
 
-    try:
-        cal_str = calendar.to_ical()
-    except Exception:
-        logger.exception("Could not serialize the calendar: {0}".format(calendar))
-        return False
-    try:
-        fo = open(ics_file, 'wb')
-    except:
-        logger.exception("Could not open {0}".format(ics_file))
-        return False
-    try:
-        fo.write(cal_str)
-    except Exception:
-        logger.exception("Could not write to {0}" .format(ics_file))
-        return False
-    finally:
-        fo.close()
-    return True
+    def serialize(self, doc):
+        try:
+            ok, element = item_to_ics(doc)
+            return element.to_ical() if ok else b""
+        except Exception as e:
+            logger.error(f"could not export item {doc.doc_id} to ics: {e}")
+            return b""
+
+    def export(self):
+        """
+        Bring ics_file up to date and return the number of items serialized. The items in the file can be imported again unchanged:
+        >>> import tempfile
+        >>> from types import SimpleNamespace
+        >>> from dateutil.rrule import MO
+        >>> from etm.data import Document
+        >>> docs = {
+        ...     1: Document({'itemtype': '*', 'summary': 'lunch', 's': pendulum.datetime(2026, 10, 20, 12, tz='local'), 'e': pendulum.duration(hours=1), 'r': [{'r': 'w', 'w': [MO], 'u': pendulum.datetime(2026, 12, 1, 12, tz='local')}], '-': [pendulum.datetime(2026, 10, 26, 12, tz='local')]}, 1),
+        ...     2: Document({'itemtype': '*', 'summary': 'holiday', 's': pendulum.date(2026, 12, 25)}, 2),
+        ...     3: Document({'itemtype': '-', 'summary': 'call', 's': pendulum.naive(2026, 10, 21, 9), 'z': 'float'}, 3),
+        ...     }
+        >>> ics_file = os.path.join(tempfile.mkdtemp(), 'items.ics')
+        >>> exporter = ICSExporter(SimpleNamespace(index=SimpleNamespace(docs=docs)), ics_file)
+        >>> exporter.export(), exporter.export()
+        (3, 0)
+        >>> [item == dict(doc) for doc, item in zip(docs.values(), iter_ics_items(ics_file))]
+        [True, True, True]
+        """
+        docs = self.table.index.docs
+        changed = not os.path.exists(self.ics_file)
+        for doc_id in [x for x in self.cache if x not in docs]:
+            del self.cache[doc_id]
+            changed = True
+        num = 0
+        for doc_id, doc in docs.items():
+            cached = self.cache.get(doc_id)
+            if cached is None or cached[0] is not doc:
+                self.cache[doc_id] = (doc, self.serialize(doc))
+                num += 1
+        if not (changed or num):
+            return 0
+        tmp = f"{self.ics_file}.tmp"
+        try:
+            with open(tmp, 'wb') as fo:
+                fo.write(self.header)
+                for doc, component in self.cache.values():
+                    fo.write(component)
+                fo.write(self.footer)
+            os.replace(tmp, self.ics_file)
+        except OSError as e:
+            logger.error(f"could not write {self.ics_file}: {e}")
+        logger.debug(f"exported {len(self.cache)} items to {self.ics_file}, {num} serialized")
+        return num
 
 if __name__ == '__main__':
     import sys
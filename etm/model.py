@@ -23,14 +23,21 @@ from dateutil.tz import gettz
 
 # for saving timers
 import pickle
+import json
 
 from warnings import filterwarnings
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def parser_info(dayfirst, yearfirst):
+    """
+    A single parserinfo instance for each setting of dayfirst and yearfirst.
+    """
+    return dateutil.parser.parserinfo(dayfirst=dayfirst, yearfirst=yearfirst)
+
 def parse(s, **kwd):
     # return pendulum_parse(s, strict=False, parserinfo=pi, **kwd)
-    pi = dateutil.parser.parserinfo(
-            dayfirst=settings['dayfirst'],
-            yearfirst=settings['yearfirst']
-            )
+    pi = parser_info(settings['dayfirst'], settings['yearfirst'])
     dt = pendulum.instance(dateutil_parse(s, parserinfo=pi))
     if 'tzinfo' in kwd:
         tz = kwd['tzinfo']
@@ -65,6 +72,7 @@ import shutil
 
 from operator import itemgetter
 from itertools import groupby, combinations
+from bisect import bisect_left, insort
 
 from prompt_toolkit.styles import Style
 from prompt_toolkit import __version__ as prompt_toolkit_version
@@ -324,6 +332,9 @@ def busy_conf_day(lofp):
         h['total'] = total
     return h
 
+expansion_regex = re.compile(r"@x\s+[a-zA-Z]+\s")
+token_regex = re.compile(r"\s[@&][a-zA-Z+-]")
+
 def process_entry(s, settings={}):
     """
     Return tuples containing key, value and postion tuples for the string s.
@@ -361,8 +372,7 @@ def process_entry(s, settings={}):
     elif s[0] not in type_keys:
         return {(0, len(s) + 1): ('itemtype', s[0])}, [('itemtype', s[0])]
     # look for expansions
-    xpat = re.compile("@x\s+[a-zA-Z]+\s")
-    match = xpat.findall(s)
+    match = expansion_regex.findall(s)
     if match and settings:
         xparts = match[0].split(' ')
         if xparts[1] in settings['expansions']:
@@ -370,9 +380,8 @@ def process_entry(s, settings={}):
             s = s.replace(match[0], replacement)
 
 
-    pattern = re.compile("\s[@&][a-zA-Z+-]")
     parts = []
-    for match in pattern.finditer(s):
+    for match in token_regex.finditer(s):
         parts.append([match.span()[0]+1, match.span()[1], match.group().strip()])
     if not parts:
         tups.append((s[0], s[1:].strip(), 0, len(s)+1))
@@ -487,6 +496,7 @@ class Item(object):
         self.set_dbfile(dbfile)
         self.object_hsh = {}    # key, val -> object version of raw string for tinydb
         self.askreply= {}       # key, val -> display version raw string
+        self.parsed = {}        # (key, val), today -> (obj, rep) from a module level do function
         self.pos_hsh = {}       # (beg, end) -> (key, val)
         self.keyvals = []
 
@@ -559,7 +569,7 @@ class Item(object):
     def set_dbfile(self, dbfile=None):
         self.settings = settings if settings else {}
         if dbfile is None:
-            self.db = ETMDB
+            self.db = DBITEM
             self.dbarch = DBARCH
             self.dbitem = DBITEM
             self.dbquery = DBITEM
@@ -886,13 +896,72 @@ class Item(object):
         self.interval, self.active = active_from_pos(self.pos_hsh, pos)
 
 
-    def text_changed(self, s, pos, modified=True):
+    def relex(self, s):
+        """
+        When s differs from self.entry only within the value of a single token and neither the old nor the new value contains an '@' or '&', return (pos_hsh, keyvals) for s obtained by replacing that token's value and shifting the positions of the tokens that follow. Otherwise return None and s must be processed in full.
+        >>> item = Item("")
+        >>> item.text_changed("* evnt @s 2p fri @e 90m @c dag", 0)
+        >>> item.relex("* evnt @s 2p fri @e 1h30m @c dag")
+        ({(0, 1): ('itemtype', '*'), (1, 7): ('summary', 'evnt'), (7, 17): ('s', '2p fri'), (17, 26): ('e', '1h30m'), (26, 33): ('c', 'dag')}, [('itemtype', '*'), ('summary', 'evnt'), ('s', '2p fri'), ('e', '1h30m'), ('c', 'dag')])
+        >>> item.relex("* evnt @s 2p fri @e 90m @c dag @l home") is None
+        True
         """
+        old = self.entry
+        if not (old and s and self.pos_hsh) or s[0] != old[0] or '@x' in s:
+            return None
+        n = min(len(old), len(s))
+        a = 0
+        while a < n and old[a] == s[a]:
+            a += 1
+        b = 0
+        while b < n - a and old[-1 - b] == s[-1 - b]:
+            b += 1
+        old_end = len(old) - b
+        delta = len(s) - len(old)
+        spans = list(self.pos_hsh.items())
+        for i, ((beg, end), (key, value)) in enumerate(spans):
+            if beg <= a < end:
+                break
+        else:
+            return None
+        start = 1 if key == 'summary' else beg + 2
+        last = end == len(old) + 1
+        if (key in ['itemtype', 'x'] or key.endswith('?') or a < start
+                or (old_end > end - 1 and not last)
+                or '@' in old[start:end] or '&' in old[start:end]):
+            return None
+        text = s[start:end + delta]
+        if '@' in text or '&' in text:
+            return None
+        if i >= len(self.keyvals) or self.keyvals[i] != (key, value):
+            return None
+        if not last and (i + 1 == len(spans) or spans[i + 1][0][0] != end or spans[i + 1][1][0].endswith('?')):
+            # the span of a value followed by a bare @ or & is irregular
+            return None
+        pos_hsh = {}
+        for j, ((b, e), kv) in enumerate(spans):
+            if j < i:
+                pos_hsh[(b, e)] = kv
+            elif j == i:
+                pos_hsh[(b, e + delta)] = (key, text.strip())
+            else:
+                pos_hsh[(b + delta, e + delta)] = kv
+        keyvals = list(self.keyvals)
+        keyvals[i] = (key, text.strip())
+        return pos_hsh, keyvals
 
+
+    def text_changed(self, s, pos, modified=True):
+        """
+        Only the token containing the change is processed again when possible, see relex, and only the changed key-value pairs are passed to update_keyval.
         """
         # self.is_modified = modified
+        if not modified:
+            # a new entry for editing
+            self.parsed = {}
+        relexed = self.relex(s)
         self.entry = s
-        self.pos_hsh, keyvals = process_entry(s, self.settings)
+        self.pos_hsh, keyvals = relexed if relexed else process_entry(s, self.settings)
         removed, changed = listdiff(self.keyvals, keyvals)
         # if removed + changed != []:
         if self.init_entry != self.entry:
@@ -935,8 +1004,18 @@ class Item(object):
                     obj = None
                     reply = msg
                 else:
-                    # call the appropriate do for the key
-                    obj, rep = do(val)
+                    # call the appropriate do for the key. The results of the module level do functions depend only upon val and the current date and are remembered unless val is given relative to the current time. Each use gets its own copy of the object.
+                    memo = (kv, pendulum.today().date())
+                    if hasattr(do, '__self__') or now_relative_regex.search(val):
+                        obj, rep = do(val)
+                    else:
+                        if memo not in self.parsed:
+                            if len(self.parsed) > 512:
+                                self.parsed = {}
+                            self.parsed[memo] = do(val)
+                        obj, rep = self.parsed[memo]
+                        if isinstance(obj, (list, dict)):
+                            obj = deepcopy(obj)
                     reply = rep if rep else r
                     if obj:
                         self.object_hsh[kv] = obj
@@ -1004,6 +1083,31 @@ class Item(object):
         return msg
 
 
+    def parse_entry(self, s):
+        """
+        Reset this item and parse s as the entry for a new reminder. Return (True, item_hsh) or (False, error message) without storing anything so that a single Item can be used to parse many reminders.
+        """
+        self.new_item()
+        self.init_entry = ""
+        self.keyvals = []
+        self.parsed = {}
+        self.object_hsh = {}
+        self.askreply = {}
+        self.pos_hsh = {}
+        self.text_changed(s, 1)
+        if not self.item_hsh.get('itemtype', None):
+            return False, "missing or invalid itemtype"
+        if not self.item_hsh.get('summary', None):
+            return False, "missing summary"
+        msg = self.check_item_hsh()
+        if msg:
+            return False, "; ".join(msg)
+        links = self.item_hsh.get('k', [])
+        if links:
+            self.item_hsh['k'] = [x for x in links if self.db.contains(doc_id=x)]
+        return True, self.item_hsh
+
+
     def update_item_hsh(self):
         msg = self.check_item_hsh()
         links = self.item_hsh.get('k', [])
@@ -1300,8 +1404,10 @@ def listdiff(old_lst, new_lst):
     >>> listdiff(old_lst, new_lst)
     ([('s', '2p fri')], [('s', '3p fri'), ('e', '90m')])
     """
-    removed = [x for x in old_lst if x not in new_lst]
-    changed = [x for x in new_lst if x not in old_lst]
+    old_set = set(old_lst)
+    new_set = set(new_lst)
+    removed = [x for x in old_lst if x not in new_set]
+    changed = [x for x in new_lst if x not in old_set]
     return removed, changed
 
 def is_duplicate(import_hsh, existing_hsh, ignore=[]):
@@ -1313,16 +1419,46 @@ def is_duplicate(import_hsh, existing_hsh, ignore=[]):
     >>> is_duplicate(import_hsh, existing_hsh, ['a'])
     True
     """
-    mpr = deepcopy(import_hsh)
-    xst = deepcopy(existing_hsh)
-    for x in ignore:
-        if x in mpr:
-            del mpr[x]
-        if x in xst:
-            del xst[x]
+    mpr = {k: v for k, v in import_hsh.items() if k not in ignore}
+    xst = {k: v for k, v in existing_hsh.items() if k not in ignore}
     return mpr == xst
 
 
+class DuplicateIndex(object):
+    """
+    Recognize reminders that duplicate either an item in the table or one already accepted in the current import. Items are compared by data.fingerprint using the fingerprints kept current by the table index, so each check is a set lookup.
+    """
+
+    def __init__(self, table=None):
+        self.index = (table if table is not None else DBITEM).index
+        self.accepted = set()
+
+    def is_duplicate(self, hsh):
+        key = data.fingerprint(hsh)
+        return key in self.accepted or key in self.index.fingerprints
+
+    def add(self, hsh):
+        self.accepted.add(data.fingerprint(hsh))
+
+    def split(self, docs):
+        """
+        Return (new, dups) where new is the list of docs that are not duplicates and dups is the number rejected.
+        """
+        new = []
+        dups = 0
+        for hsh in docs:
+            if self.is_duplicate(hsh):
+                dups += 1
+            else:
+                self.add(hsh)
+                new.append(hsh)
+        return new, dups
+
+
+date_calc_regex = re.compile(r'^\s*(.+)\s+([+-])\s+(.+)\s*$')
+timezone_regex = re.compile(r'^(.+)\s+([A-Za-z]+/[A-Za-z]+)$')
+period_string_regex = re.compile(r'^\s*(([+-]?\d+[wdhmMy])+\s*$)')
+
 def datetime_calculator(s):
     """
     s has the format:
@@ -1343,10 +1479,6 @@ def datetime_calculator(s):
     >>> datetime_calculator("2019-04-06 5:30pm US/Eastern + 8h15m Europe/Paris")
     'Sun Apr 7 2019 7:45AM CEST'
     """
-    date_calc_regex = re.compile(r'^\s*(.+)\s+([+-])\s+(.+)\s*$')
-    timezone_regex = re.compile(r'^(.+)\s+([A-Za-z]+/[A-Za-z]+)$')
-    period_string_regex = re.compile(r'^\s*(([+-]?\d+[wdhmMy])+\s*$)')
-
     ampm = settings.get('ampm', True)
     datetime_fmt = "ddd MMM D YYYY h:mmA zz" if ampm else "ddd MMM D YYYY H:mm zz"
     m = date_calc_regex.match(s)
@@ -1386,7 +1518,27 @@ def datetime_calculator(s):
         return f'error parsing "{s}"'
 
 
+dt_and_dur_regex = re.compile(r'^(.+)\s+([+-].+)?$')
+
+# values with a part that parse_datetime would parse each time
+now_relative_regex = re.compile(r'now|(^|[,:]\s*)[+-]')
+
 def parse_datetime(s, z=None):
+    """
+    Return parse_dt(s, z) using a cache for strings whose meaning depends, at most, upon the current date. The cache key includes the dayfirst and yearfirst settings and today's date since, e.g., '2p fri' or '9a' depend upon it. Strings involving 'now' or given relative to the current time are parsed each time.
+    """
+    if not s:
+        return False, '', z
+    s = s.strip()
+    if 'now' in s or s[0] in ['+', '-']:
+        return parse_dt(s, z)
+    return cached_parse_dt(s, z, settings.get('dayfirst'), settings.get('yearfirst'), pendulum.today().date())
+
+@lru_cache(maxsize=1024)
+def cached_parse_dt(s, z, dayfirst, yearfirst, today):
+    return parse_dt(s, z)
+
+def parse_dt(s, z=None):
     """
     's' will have the format 'datetime string' Return a 'date' object if the parsed datetime is exactly midnight. Otherwise return a naive datetime object if 'z == float' or an aware datetime object converting to UTC using tzlocal if z == None and using the timezone specified in z otherwise.
     >>> dt = parse_datetime("2015-10-15 2p")
@@ -1442,8 +1594,6 @@ def parse_datetime(s, z=None):
 
         dt_str = ''
         dur_str = ''
-        dt_and_dur_regex = re.compile(r'^(.+)\s+([+-].+)?$')
-        days_or_more_regex = re.compile(r'[dwM]')
         g = dt_and_dur_regex.match(s)
         if g:
             # we have dt and dur strings
@@ -1691,6 +1841,7 @@ threeday_regex = re.compile(r'([+-]?[1234])(MON|TUE|WED|THU|FRI|SAT|SUN)', re.IG
 anniversary_regex = re.compile(r'!(\d{4})!')
 
 
+@lru_cache(maxsize=1024)
 def parse_duration(s):
     """\
     Take a period string and return a corresponding pendulum.duration.
@@ -1888,6 +2039,106 @@ class NDict(dict):
         return "\n".join(self.output), self.row2id
 
 
+class CompletionIndex(object):
+    """
+    The completions for @-keys from the items table together with the number of items using each and the order in which they were last used. The completions are kept sorted so that those beginning with a given prefix are found by bisection and the index is maintained from document changes. A completion is removed when the last item using it is removed or changed.
+    """
+
+    completion_keys = ['c', 'g', 'i', 'k', 'l', 'n', 't']
+
+    def __init__(self):
+        self.sorted = []
+        self.counts = {}
+        self.used = {}
+        self.tick = 0
+        # completions added by append that load should keep
+        self.appended = {}
+
+    @classmethod
+    def for_doc(cls, doc):
+        """
+        The set of completions provided by doc.
+        """
+        completions = set([])
+        if doc.get('itemtype') == '%' and doc.get('i', None):
+            completions.add(f"@k {doc['i']} {doc['itemtype']} {doc['summary']}: {doc.doc_id}")
+        for x, v in doc.items():
+            if x not in cls.completion_keys:
+                continue
+            if isinstance(v, list):
+                if x == 'k':
+                    continue
+                for p in v:
+                    completions.add(f"@{x} {p}")
+            else:
+                completions.add(f"@{x} {v}")
+        return completions
+
+    def add_completion(self, completion, count=1):
+        if completion not in self.counts:
+            self.counts[completion] = 0
+            insort(self.sorted, completion)
+        self.counts[completion] += count
+        self.tick += 1
+        self.used[completion] = self.tick
+
+    def discard_completion(self, completion):
+        if completion not in self.counts:
+            return
+        self.counts[completion] -= 1
+        if self.counts[completion] <= 0:
+            del self.counts[completion]
+            self.used.pop(completion, None)
+            i = bisect_left(self.sorted, completion)
+            if i < len(self.sorted) and self.sorted[i] == completion:
+                del self.sorted[i]
+
+    def load(self, docs):
+        counts = dict(self.appended)
+        for doc in docs:
+            for completion in self.for_doc(doc):
+                counts[completion] = counts.get(completion, 0) + 1
+        self.counts = counts
+        self.used = {}
+        self.sorted = sorted(counts)
+
+    def update(self, old, new):
+        """
+        Reflect the change of a document from old to new, either of which may be None.
+        """
+        before = self.for_doc(old) if old is not None else set()
+        after = self.for_doc(new) if new is not None else set()
+        for completion in before - after:
+            self.discard_completion(completion)
+        for completion in after - before:
+            self.add_completion(completion)
+        for completion in after & before:
+            # still in use - just note the use
+            self.tick += 1
+            self.used[completion] = self.tick
+
+    def append(self, completion):
+        """
+        Add a completion, e.g., for an @x expansion, that does not come from a document.
+        """
+        self.appended[completion] = self.appended.get(completion, 0) + 1
+        self.add_completion(completion, 1)
+
+    def with_prefix(self, prefix):
+        """
+        The completions beginning with prefix, the most used first and then the most recently used.
+        """
+        i = bisect_left(self.sorted, prefix)
+        j = bisect_left(self.sorted, prefix + '\U0010ffff')
+        return sorted(self.sorted[i:j], key=lambda x: (-self.counts.get(x, 0), -self.used.get(x, 0), x))
+
+    def __iter__(self):
+        return iter(self.sorted)
+
+    def __len__(self):
+        return len(self.sorted)
+
+
 class DataView(object):
 
     def __init__(self, etmdir):
@@ -1908,6 +2159,8 @@ class DataView(object):
         self.query_view = ""
         self.query_text = ""
         self.query_items = []
+        # recent query renderings, least recently used first
+        self.query_rendered = {}
         self.query_mode = "items table"
         self.report_view = ""
         self.report_text = ""
@@ -1916,26 +2169,19 @@ class DataView(object):
         self.history_view = ""
         self.cache = {}
         self.itemcache = {}
+        self.viewrows = ViewRows()
+        self.revision = data.changes.revision
         self.used_summary = {}
         self.used_details = {}
         self.used_details2id = {}
         self.currMonth()
-        self.completions = []
+        self.completions = CompletionIndex()
         self.konnections_from = {}
         self.konnections_to = {}
         self.konnected = []
-        if os.path.exists(timers_file):
-            with open(timers_file, 'rb') as fn:
-                self.timers = pickle.load(fn)
-            self.active_timer = None
-            for x in self.timers:
-                if self.timers[x][0] == 'p':
-                    self.active_timer = x
-                    break
-        else:
-            self.timers = {}
-            self.active_timer = None
-        self.saved_timers = deepcopy(self.timers)
+        self.timers = {}
+        self.active_timer = None
+        self.load_timers()
         self.archive_after = 0
         self.set_etmdir(etmdir)
         self.views = {
@@ -1959,23 +2205,48 @@ class DataView(object):
                 'y': 'yearly',
                 }
 
-        self.completion_keys = ['c', 'g', 'i', 'k', 'l', 'n', 't']
         self.edit_item = None
         self.is_showing_details = False
         self.is_showing_query = False
         self.is_showing_help = False
         self.is_editing = False
         self.is_showing_items = True
-        self.get_completions()
-        self.refresh_konnections()
-        self.refreshRelevant()
+        # keep the caches current from here on
+        data.changes.subscribe(self.changed)
+        # only what the agenda for the current week needs - the rest is
+        # left for startup_stages after the agenda has been displayed
+        self.set_now()
+        self.currentYrWk = getWeekNum(self.now)
+        self.current, self.alerts, self.id2relevant = relevant(self.db, self.now, self.pinned_list, self.link_list, self.konnected, self.timers)
         self.activeYrWk = self.currentYrWk
         self.calAdv = pendulum.today().month // 7
 
         self.refreshAgenda()
-        self.refreshCurrent()
         self.currcal()
 
+    def startup_stages(self):
+        """
+        The (name, method) pairs for the work deferred by __init__, to be called in order once the agenda for the current week has been displayed.
+        """
+        return [
+                ('archive', self.possible_archive),
+                ('completions', self.get_completions),
+                ('konnections', self.refresh_konnections),
+                ('used time', self.refresh_viewrows),
+                ('weeks', self.refresh_weeks),
+                ]
+
+    def refresh_viewrows(self):
+        self.viewrows.refresh(DBITEM)
+
+    def refresh_weeks(self):
+        """
+        Schedule the weeks before and after the current one, now with the konnections and used times, and save the current and next files.
+        """
+        self.refreshRelevant()
+        self.refreshAgenda()
+        self.refreshCurrent()
+
     def set_etmdir(self, etmdir):
         self.etmdir = etmdir
         self.backupdir = os.path.join(self.etmdir, 'backups')
@@ -1991,6 +2262,10 @@ class DataView(object):
             self.nextfile = os.path.normpath(os.path.join(etmdir, 'next.txt'))
         else:
             self.nextfile = None
+        if 'keep_ics' in self.settings and self.settings['keep_ics']:
+            self.ics_export = ical.ICSExporter(DBITEM, os.path.normpath(os.path.join(etmdir, 'items.ics')))
+        else:
+            self.ics_export = None
 
         if 'locale' in self.settings:
             locale_str = settings['locale']
@@ -2022,7 +2297,6 @@ class DataView(object):
         self.db = DBITEM
         self.dbarch = DBARCH
         logger.info(f"items: {len(DBITEM)}; archive: {len(DBARCH)}")
-        self.possible_archive()
         self.update_links()
 
     def use_archive(self):
@@ -2037,53 +2311,17 @@ class DataView(object):
         """
         Get completions from db items
         """
-        completions = set([])
-        for item in self.db:
-            found = {x: v for x, v in item.items() if x in self.completion_keys}
-
-            if item['itemtype'] == '%' and item.get('i', None):
-                tmp = f"@k {item['i']} {item['itemtype']} {item['summary']}: {item.doc_id}"
-                completions.add(tmp)
-            for x, v in found.items():
-                if isinstance(v, list):
-                    if x == 'k':
-                        continue
-                    for p in v:
-                        completions.add(f"@{x} {p}")
-                else:
-                    completions.add(f"@{x} {v}")
-        self.completions = list(completions)
-        self.completions.sort()
-
-    def update_completions(self, item):
-        """
-        update self.completions, if necessary, for the @keys in item
-        """
-        completions = set([])
-
-        found = {x: v for x, v in item.item_hsh.items() if x in self.completion_keys}
-        for x, v in found.items():
-            # if x == 'k':
-            if isinstance(v, list):
-                for p in v:
-                    completions.add(f"@{x} {p}")
-            else:
-                completions.add(f"@{x} {v}")
-        new = [x for x in list(completions) if x not in self.completions]
-        if new:
-            self.completions.extend(new)
-            self.completions.sort()
+        self.completions.load(self.db)
 
-    def update_konnections(self, item):
+    def update_konnections(self, doc_id, hsh=None):
         """
-        Only change relevant hashes
+        Only change relevant hashes. hsh is None when doc_id has been removed.
         """
         # the original @k entries
-        orig = self.konnections_from.get(item.doc_id, []) if item.doc_id else []
+        orig = self.konnections_from.get(doc_id, []) if doc_id else []
 
-        # the new and valid @k entries
-        # links = [x for x in item.item_hsh.get('k', []) if self.db.contains(doc_id = x)]
-        links = item.item_hsh.get('k', [])
+        # the new @k entries
+        links = hsh.get('k', []) if hsh else []
 
         # remove duplicates
         links = list(set(links))
@@ -2091,20 +2329,24 @@ class DataView(object):
         # upate konnections_from to the new, valid,
         # and non-duplicate @k's
         if links:
-            self.konnections_from[item.doc_id] = links
-        elif item.doc_id in self.konnections_from:
-            del self.konnections_from[item.doc_id]
+            self.konnections_from[doc_id] = links
+        elif doc_id in self.konnections_from:
+            del self.konnections_from[doc_id]
 
         # these @k's were added
         added = [x for x in links if x not in orig]
         # these @k's were removed
         removed = [x for x in orig if x not in links]
 
-        for link in links:
-            if link in added:
-                self.konnections_to.setdefault(link, []).append(item.doc_id)
-            elif link in removed:
-                self.konnections_to[link].remove(item.doc_id)
+        for link in added:
+            self.konnections_to.setdefault(link, []).append(doc_id)
+        for link in removed:
+            if doc_id in self.konnections_to.get(link, []):
+                self.konnections_to[link].remove(doc_id)
+                if not self.konnections_to[link]:
+                    del self.konnections_to[link]
+        if hsh is None and doc_id in self.konnections_to:
+            del self.konnections_to[doc_id]
 
         # now update konnected to reflect the changes
         konnected = [x for x in self.konnections_to] + [x for x in self.konnections_from]
@@ -2189,26 +2431,102 @@ class DataView(object):
                 os.remove(f)
         return True
 
+    def timer_event(self, doc_id, state, at=None, period=None):
+        """
+        Append the event to the timers log. A state of 'x' records the removal of the timer for doc_id.
+        """
+        event = {'id': doc_id, 'state': state}
+        if at is not None:
+            event['at'] = at.timestamp()
+            event['period'] = period.total_seconds()
+        try:
+            with open(timers_file, 'a') as fo:
+                fo.write(json.dumps(event) + '\n')
+            self.timer_events += 1
+        except OSError as e:
+            logger.error(f"error writing to {timers_file}: {e}")
+
+    def set_timer(self, doc_id, state, at, period):
+        self.timers[doc_id] = [state, at, period]
+        self.timer_event(doc_id, state, at, period)
+
+    def drop_timer(self, doc_id):
+        if doc_id not in self.timers:
+            return
+        del self.timers[doc_id]
+        self.timer_event(doc_id, 'x')
+
+    def load_timers(self):
+        """
+        Replay the timers log to reconstruct self.timers. A timer left running is paused as of the last time the log was touched by save_timers. A legacy timers.pkl is converted to the log.
+        """
+        self.timers = {}
+        self.active_timer = None
+        self.timer_events = 0
+        legacy = os.path.join(os.path.dirname(timers_file), 'timers.pkl')
+        if os.path.exists(timers_file):
+            checked = pendulum.from_timestamp(os.path.getmtime(timers_file), tz='local')
+            with open(timers_file, 'r') as fo:
+                for line in fo:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"skipping bad line in {timers_file}: {line!r}")
+                        continue
+                    self.timer_events += 1
+                    if event['state'] == 'x':
+                        self.timers.pop(event['id'], None)
+                        continue
+                    at = pendulum.from_timestamp(event['at'], tz='local')
+                    self.timers[event['id']] = [event['state'], at, pendulum.Duration(seconds=event['period'])]
+            for doc_id, (state, start, period) in self.timers.items():
+                if state == 'r':
+                    # etm was closed with this timer running
+                    checked = max(checked, start)
+                    self.timers[doc_id] = ['p', checked, period + (checked - start)]
+        elif os.path.exists(legacy):
+            with open(legacy, 'rb') as fn:
+                self.timers = {k: list(v) for k, v in pickle.load(fn).items()}
+            logger.info(f"converting {legacy} to {timers_file}")
+        for x in self.timers:
+            if self.timers[x][0] == 'p':
+                self.active_timer = x
+                break
+        self.compact_timers()
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    def compact_timers(self):
+        """
+        Rewrite the timers log with a single event for each current timer.
+        """
+        if not self.timers:
+            if os.path.exists(timers_file):
+                logger.debug(f"removing {timers_file}")
+                os.remove(timers_file)
+            self.timer_events = 0
+            return
+        tmp = f"{timers_file}.tmp"
+        with open(tmp, 'w') as fo:
+            for doc_id, (state, at, period) in self.timers.items():
+                fo.write(json.dumps({'id': doc_id, 'state': state, 'at': at.timestamp(), 'period': period.total_seconds()}) + '\n')
+        os.replace(tmp, timers_file)
+        self.timer_events = len(self.timers)
+
     def save_timers(self):
-        timers = deepcopy(self.timers)
-        if self.active_timer and self.active_timer in timers:
-            state, start, period = timers[self.active_timer]
-            if state == 'r':
-                now = pendulum.now('local')
-                period += now - start
-                state = 'p'
-                timers[self.active_timer] = [state, now, period]
-        if timers:
-            if timers != self.saved_timers:
-                logger.debug(f"timers changed - dumping to {timers_file}")
-                with open(timers_file, 'wb') as fn:
-                    pickle.dump(timers, fn)
-                self.saved_timers = timers
-            else:
-                logger.debug(f"timers unchanged - skipping dump to {timers_file}")
-        elif os.path.exists(timers_file):
-            logger.debug(f"removing {timers_file}")
-            os.remove(timers_file)
+        """
+        Called every minute. Timer changes are already in the log so just touch it while a timer is running and compact it when it has grown.
+        """
+        if self.timer_events > 4 * len(self.timers) + 64:
+            logger.debug(f"compacting {timers_file}")
+            self.compact_timers()
+        elif not self.timers:
+            if os.path.exists(timers_file):
+                self.compact_timers()
+        elif (self.active_timer in self.timers
+                and self.timers[self.active_timer][0] == 'r'
+                and os.path.exists(timers_file)):
+            os.utime(timers_file)
         # this return is necessary to avoid blocking event_handler
         return
 
@@ -2224,8 +2542,7 @@ class DataView(object):
             state = 'p'
         else:
             state = 'r'
-        self.timers[self.active_timer] = [state, now, period]
-        self.save_timers()
+        self.set_timer(self.active_timer, state, now, period)
 
 
     # bound to T
@@ -2250,10 +2567,7 @@ class DataView(object):
         """
         if not doc_id:
             return
-        other_timers = deepcopy(self.timers)
-        if doc_id in other_timers:
-            del other_timers[doc_id]
-        active = [x for x, v in other_timers.items() if v[0] in ['r', 'p']]
+        active = [x for x, v in self.timers.items() if x != doc_id and v[0] in ['r', 'p']]
         if len(active) > 1:
             logger.warning(f"more than one active timer: {active}")
         now = pendulum.now('local')
@@ -2264,7 +2578,7 @@ class DataView(object):
                 for x in active:
                     active_state, active_start, active_period = self.timers[x]
                     active_period = active_period + now - active_start if active_state == 'r' else active_period
-                    self.timers[x] = ['i', now, active_period]
+                    self.set_timer(x, 'i', now, active_period)
             state, start, period = self.timers[doc_id]
             if state == 'i':
                 # the timer for this item is inactive
@@ -2277,7 +2591,7 @@ class DataView(object):
                 # toggle the state
                 state = 'p' if state == 'r' else 'r'
             self.active_timer = doc_id
-            self.timers[doc_id] = state, now, period
+            self.set_timer(doc_id, state, now, period)
         elif doc_id:
             # there is no timer for this item
             # create the timer
@@ -2287,10 +2601,9 @@ class DataView(object):
                 # no other timer is active so start this timer
                 state = 'r'
                 self.active_timer = doc_id
-            self.timers[doc_id] = [state, now, ZERO]
+            self.set_timer(doc_id, state, now, ZERO)
 
         logger.debug(f"next timer state for doc_id {doc_id}: {self.timers[doc_id]}")
-        self.save_timers()
         return True, doc_id, active
 
 
@@ -2308,10 +2621,7 @@ class DataView(object):
                 delta += elapsed
             active = f"{status}:{format_duration(delta, short=True)}"
         if len(self.timers) > 1:
-            timers = deepcopy(self.timers)
-            if self.active_timer in timers:
-                del timers[self.active_timer]
-            relevant = [round_minutes(v[2]) for k, v in timers.items() if v[2] > zero]
+            relevant = [round_minutes(v[2]) for k, v in self.timers.items() if k != self.active_timer and v[2] > zero]
             if relevant:
                 total = zero
                 for v in relevant:
@@ -2329,12 +2639,27 @@ class DataView(object):
             return
         if doc_id == self.active_timer:
             self.active_timer = None
-        if doc_id in self.timers:
-            del self.timers[doc_id]
-        self.save_timers()
+        self.drop_timer(doc_id)
         self.show_active_view()
 
 
+    def changed(self, revision, name, changes):
+        """
+        Subscriber to data.changes. Update the caches that depend upon the items table for the documents in changes.
+        """
+        if name != 'items':
+            return
+        self.revision = revision
+        for doc_id, old, new in changes:
+            if doc_id in self.itemcache:
+                del self.itemcache[doc_id]
+            self.viewrows.update(doc_id, new)
+            self.update_konnections(doc_id, new)
+            self.completions.update(old, new)
+        # agenda weeks are recomputed on demand
+        self.cache = {}
+
+
     def set_now(self):
         self.now = pendulum.now('local')
 
@@ -2366,28 +2691,28 @@ class DataView(object):
             # self.refreshCalendar()
             return self.calendar_view
         if self.active_view == 'history':
-            self.history_view, self.row2id = show_history(self.db, True, self.pinned_list, self.link_list, self.konnected, self.timers)
+            self.history_view, self.row2id = self.viewrows.render('history', self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.history_view
         if self.active_view == 'timers':
-            self.timers_view, self.row2id = show_timers(self.db, self.pinned_list, self.link_list, self.konnected, self.timers, self.active_timer)
+            self.timers_view, self.row2id = show_timers(self.viewrows, self.pinned_list, self.link_list, self.konnected, self.timers, self.active_timer)
             return self.timers_view
         if self.active_view == 'forthcoming':
             self.forthcoming_view, self.row2id = show_forthcoming(self.db, self.id2relevant, self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.forthcoming_view
         if self.active_view == 'do next':
-            self.next_view, self.row2id = show_next(self.db, self.pinned_list, self.link_list, self.konnected, self.timers)
+            self.next_view, self.row2id = self.viewrows.render('do next', self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.next_view
         if self.active_view == 'journal':
-            self.journal_view, self.row2id = show_journal(self.db, self.id2relevant, self.pinned_list, self.link_list, self.konnected, self.timers)
+            self.journal_view, self.row2id = self.viewrows.render('journal', self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.journal_view
         if self.active_view == 'tags':
-            self.tag_view, self.row2id = show_tags(self.db, self.id2relevant, self.pinned_list, self.link_list, self.konnected, self.timers)
+            self.tag_view, self.row2id = self.viewrows.render('tags', self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.tag_view
         if self.active_view == 'index':
-            self.index_view, self.row2id = show_index(self.db, self.id2relevant, self.pinned_list, self.link_list, self.konnected, self.timers)
+            self.index_view, self.row2id = self.viewrows.render('index', self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.index_view
         if self.active_view == 'location':
-            self.index_view, self.row2id = show_location(self.db, self.id2relevant, self.pinned_list, self.link_list, self.konnected, self.timers)
+            self.index_view, self.row2id = self.viewrows.render('location', self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.index_view
         if self.active_view == 'pinned':
             self.pinned_view, self.row2id = show_pinned(self.get_pinned(), self.pinned_list, self.link_list, self.konnected, self.timers)
@@ -2409,19 +2734,27 @@ class DataView(object):
             self.used_summary_view = used_summary
             return self.used_summary_view
         if self.active_view == 'review':
-            self.review_view, self.row2id = show_review(self.db, self.pinned_list, self.link_list, self.konnected, self.timers)
+            self.review_view, self.row2id = self.viewrows.render('review', self.pinned_list, self.link_list, self.konnected, self.timers)
             return self.review_view
         if self.active_view == 'konnected':
             self.konnected_view, self.row2id = show_konnected(self.db, self.pinned_list, self.link_list, self.konnected, self.timers, self.active_item, self.konnections_from, self.konnections_to)
             return self.konnected_view
         if self.active_view == 'query':
             if self.query_text:
-                if len(self.query_text) > 1 and self.query_text[1] == ' ' and self.query_text[0] in ['s', 'u', 'm', 'c']:
-                    # complex query
-                    self.query_view, self.row2id = show_query_results(self.query_text, self.query_grpby, self.query_items)
-                else:
-                    # standard query
-                    self.query_view, self.row2id = show_query_items(self.query_text, self.query_items, self.pinned_list, self.link_list, self.konnected, self.timers)
+                # the rendering is reused if the table, query, items, revision and flags are unchanged
+                key = (getattr(self.db, 'name', ''), self.query_text, data.changes.revision, shutil.get_terminal_size()[0], tuple(x.doc_id for x in self.query_items) if isinstance(self.query_items, list) else self.query_items, tuple(self.pinned_list), tuple(self.link_list), tuple(self.konnected), tuple(self.timers))
+                res = self.query_rendered.pop(key, None)
+                if res is None:
+                    if len(self.query_text) > 1 and self.query_text[1] == ' ' and self.query_text[0] in ['s', 'u', 'm', 'c']:
+                        # complex query
+                        res = show_query_results(self.query_text, self.query_grpby, self.query_items)
+                    else:
+                        # standard query
+                        res = show_query_items(self.query_text, self.query_items, self.pinned_list, self.link_list, self.konnected, self.timers)
+                self.query_rendered[key] = res
+                while len(self.query_rendered) > 16:
+                    del self.query_rendered[next(iter(self.query_rendered))]
+                self.query_view, self.row2id = res
             else:
                 self.query_view = ""
                 self.row2id = {}
@@ -2508,11 +2841,15 @@ class DataView(object):
             logger.info(f"saved current schedule to {self.currfile}")
 
         if self.nextfile is not None:
-            next_view, row2id = show_next(self.db, self.pinned_list, self.link_list, self.konnected, self.timers)
+            next_view, row2id = self.viewrows.render('do next', self.pinned_list, self.link_list, self.konnected, self.timers)
             with open(self.nextfile, 'w', encoding='utf-8') as fo:
                 fo.write(next_view)
             logger.info(f"saved do next to {self.nextfile}")
 
+        if self.ics_export is not None:
+            # only the items changed since the last export are serialized
+            self.ics_export.export()
+
 
     def show_query(self):
         self.is_showing_query = True
@@ -2557,11 +2894,13 @@ class DataView(object):
             return None, ''
         item_id = res[0]
 
-        if not edit and item_id in self.itemcache:
+        if not edit and self.db is DBITEM and item_id in self.itemcache:
             return item_id, self.itemcache[item_id]
         item = self.db.get(doc_id=item_id)
         if item:
             item_hsh = item_details(item, edit)
+            if not edit and self.db is DBITEM:
+                self.itemcache[item_id] = item_hsh
             return item_id, item_hsh
         return None, ''
 
@@ -2694,7 +3033,7 @@ class DataView(object):
 
     def refreshCache(self):
         self.cache = schedule(ETMDB, self.currentYrWk, self.current, self.now, 5, 20, self.pinned_list, self.link_list, self.konnected, self.timers)
-        self.used_details, self.used_details2id, self.used_summary = get_usedtime(self.db, self.pinned_list, self.link_list, self.konnected, self.timers)
+        self.used_details, self.used_details2id, self.used_summary = self.viewrows.usedtime(self.pinned_list, self.link_list, self.konnected, self.timers)
 
     def update_links(self):
         """
@@ -5276,6 +5615,13 @@ def update_db(db, id, hsh={}):
         logger.error(f"Error updating document corresponding to id {id}\nhsh {hsh}\nexception: {repr(e)}")
 
 def write_back(db, docs):
+    if isinstance(db, data.FeedTable):
+        # a single write for all the docs
+        try:
+            db.write_back(docs)
+        except Exception as e:
+            logger.error(f"exception: {e}")
+        return
     for doc in docs:
         try:
             doc_id = doc.doc_id
@@ -5404,102 +5750,103 @@ def show_query_items(text, items=[], pinned_list=[], link_list=[], konnect_list=
     return tree, row2id
 
 
-def show_history(db, reverse=True, pinned_list=[], link_list=[], konnect_list=[], timers={}):
-    width = shutil.get_terminal_size()[0] - 2
-    rows = []
-    summary_width = width - 25
-    for item in db:
-        mt = item.get('modified', None)
-        if mt is not None:
-            dt, label = mt, 'm'
-        else:
-            dt, label = item.get('created', None), 'c'
-        if dt is not None:
-            id = item.doc_id
-            year = dt.format("YYYY")
-            monthday = dt.format("MMM D").ljust(6, ' ')
-            c5dt = fivechar_datetime(dt)
-            # time = fmt_time(dt).rjust(7, ' ')
-            rhc = f"{c5dt} {label}"
-            itemtype = FINISHED_CHAR if 'f' in item else item.get('itemtype', '?')
-            summary = item['summary']
-            flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
-            path = '    m: last modified; c: created; most recent first'
-            rows.append(
-                    {
-                        'sort': dt,
-                        'path': path,
-                        'values': [
-                            itemtype,
-                            summary,
-                            flags,
-                            rhc,
-                            id
-                            ],
-                    }
-                    )
+HISTORY_PATH = '    m: last modified; c: created; most recent first'
+
+def render_rows(rows, pinned_list=[], link_list=[], konnect_list=[], timers={}, reverse=False, paths=None):
+    """
+    Flag, sort and render rows from the row builders below. If given, paths(row) returns the list of paths under which the row should appear, otherwise row['path'] is used.
+    """
+    for row in rows:
+        row['values'][2] = get_flags(row['id'], link_list, konnect_list, pinned_list, timers)
     try:
         rows.sort(key=itemgetter('sort'), reverse=reverse)
-    except:
+    except Exception as e:
         logger.error(f"sort exception: {e}: {[type(x['sort']) for x in rows]}")
     rdict = NDict()
     for row in rows:
-        path = row['path']
         values = row['values']
-        rdict.add(path, values)
+        for path in (paths(row) if paths else [row['path']]):
+            try:
+                rdict.add(path, values)
+            except Exception as e:
+                logger.error(f"error adding path: {path}, values: {values}: {e}")
     tree, row2id = rdict.as_tree(rdict, level=0)
     return tree, row2id
 
 
-def show_review(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
-    """
-    Unfinished, undated tasks and jobs
-    """
-    width = shutil.get_terminal_size()[0] - 2
-    rows = []
-    locations = set([])
-    summary_width = width - 18
-    for item in db:
-        if item.get('itemtype', None) not in ['-'] or 's' in item or 'f' in item:
-            continue
-        id = item.doc_id
-        rhc = item.get('l', '~')[:10].ljust(10, ' ')
-        itemtype = item['itemtype']
-        summary = item['summary']
-        flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
-        modified = item['modified'] if 'modified' in item else item['created']
+def history_rows(item):
+    mt = item.get('modified', None)
+    if mt is not None:
+        dt, label = mt, 'm'
+    else:
+        dt, label = item.get('created', None), 'c'
+    if dt is None:
+        return []
+    id = item.doc_id
+    c5dt = fivechar_datetime(dt)
+    rhc = f"{c5dt} {label}"
+    itemtype = FINISHED_CHAR if 'f' in item else item.get('itemtype', '?')
+    return [{
+            'id': id,
+            'sort': dt,
+            'path': HISTORY_PATH,
+            'values': [
+                itemtype,
+                item['summary'],
+                '',
+                rhc,
+                id
+                ],
+            }]
+
+
+def show_history(db, reverse=True, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+    rows = [row for item in db for row in history_rows(item)]
+    return render_rows(rows, pinned_list, link_list, konnect_list, timers, reverse=reverse)
+
 
-        weeks = (pendulum.now() - modified).days // 7
+def review_rows(item):
+    if item.get('itemtype', None) not in ['-'] or 's' in item or 'f' in item:
+        return []
+    id = item.doc_id
+    rhc = item.get('l', '~')[:10].ljust(10, ' ')
+    modified = item['modified'] if 'modified' in item else item['created']
+    return [{
+            'id': id,
+            'sort': modified,
+            'values': [
+                item['itemtype'],
+                item['summary'],
+                '',
+                rhc, # location
+                id,
+                ]
+            }]
+
+
+def review_paths(now=None):
+    """
+    The review path depends upon the number of weeks since the last modification and thus upon now.
+    """
+    now = now or pendulum.now()
+    def paths(row):
+        weeks = (now - row['sort']).days // 7
         if weeks == 0:
             wkfmt = " This week"
         elif weeks == 1:
             wkfmt = " Last week"
         else:
             wkfmt = f" {weeks} weeks ago"
-        rows.append(
-                {
-                    'path': wkfmt,
-                    'sort': modified,
-                    'values': [
-                        itemtype,
-                        summary,
-                        flags,
-                        rhc, # location
-                        id,
-                        ]
-                }
-                )
-    try:
-        rows.sort(key=itemgetter('sort'), reverse=False)
-    except Exception as e:
-        logger.error(f"sort exception: {e}: {[type(x['sort']) for x in rows]}")
-    rdict = NDict()
-    for row in rows:
-        path = row['path']
-        values = row['values']
-        rdict.add(path, values)
-    tree, row2id = rdict.as_tree(rdict, level=0)
-    return tree, row2id
+        return [wkfmt]
+    return paths
+
+
+def show_review(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+    """
+    Unfinished, undated tasks and jobs
+    """
+    rows = [row for item in db for row in review_rows(item)]
+    return render_rows(rows, pinned_list, link_list, konnect_list, timers, paths=review_paths())
 
 def show_timers(db, pinned_list=[], link_list=[], konnect_list=[], timers={}, active_timer=None):
     """
@@ -5619,253 +5966,199 @@ def show_konnected(db, pinned_list=[], link_list=[], konnect_list=[], timers={},
     return tree, row2id
 
 
-def show_next(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
-    """
-    Unfinished, undated tasks and jobs
-    """
-    width = shutil.get_terminal_size()[0] - 2
+def next_rows(item):
+    if item.get('itemtype', None) not in ['-'] or 's' in item or 'f' in item:
+        return []
     rows = []
-    locations = set([])
-    group_names = []
-    groups = settings.get('locations', {})
-    logger.debug(f"groups: {groups}")
-    using_groups = True if groups else False
-    if using_groups:
-        group_names = groups.keys()
-        location2groups = {'~': ['OTHER']}
-        for group, locations in groups.items():
-            for location in locations:
-                logger.debug(f"location: {location}")
-                location2groups.setdefault(location, []).append(group)
-        logger.debug(f"group_names: {group_names}; location2groups: {location2groups}")
-
-    for item in db:
-        if item.get('itemtype', None) not in ['-'] or 's' in item or 'f' in item:
-            continue
-        id = item.doc_id
-        flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
-        if 'j' in item:
-            task_location = item.get('l', '~')
-            priority = int(item.get('p', 0))
-            sort_priority = 4 - int(priority)
-            show_priority = str(priority) if priority > 0 else ""
-            for job in item['j']:
-                if job.get('f'):
-                    # show completed jobs only in completed view
-                    continue
-                location = job.get('l', task_location)
-                extent = job.get('e', '')
-                extent = format_duration(extent) if extent else ''
-                status = 0 if job.get('status') == '-' else 1
-                # status 1 -> waiting, status 0 -> available
-                rhc = " ".join([show_priority, extent]).center(7, ' ')
-                summary = job.get('summary')
-                job_id = job.get('i', None)
-                job_sort = str(job_id)
-                rows.append(
-                    {
-                        'id': item.doc_id,
-                        'job': job_id,
-                        'instance': None,
-                        'sort': (location, status, sort_priority, job_sort, job.get('summary', '')),
-                        'location': location,
-                        'columns': [
-                            job.get('status', ''),
-                            summary,
-                            flags,
-                            rhc,
-                            (id, None, job_id)
-                            ]
-                    }
-                )
-        else:
-            location = item.get('l', '~')
-            priority = int(item.get('p', 0))
-            extent = item.get('e', '')
-            extent = format_duration(extent) if extent else ""
-            sort_priority = 4 - int(priority)
-            show_priority = str(priority) if priority > 0 else ""
+    id = item.doc_id
+    if 'j' in item:
+        task_location = item.get('l', '~')
+        priority = int(item.get('p', 0))
+        sort_priority = 4 - int(priority)
+        show_priority = str(priority) if priority > 0 else ""
+        for job in item['j']:
+            if job.get('f'):
+                # show completed jobs only in completed view
+                continue
+            location = job.get('l', task_location)
+            extent = job.get('e', '')
+            extent = format_duration(extent) if extent else ''
+            status = 0 if job.get('status') == '-' else 1
+            # status 1 -> waiting, status 0 -> available
             rhc = " ".join([show_priority, extent]).center(7, ' ')
-            summary = item['summary']
+            summary = job.get('summary')
+            job_id = job.get('i', None)
+            job_sort = str(job_id)
             rows.append(
-                    {
-                        'id': item.doc_id,
-                        'job': None,
-                        'instance': None,
-                        'sort': (location, sort_priority, extent, item['summary']),
-                        'location': location,
-                        'columns': [
-                            item['itemtype'],
-                            summary,
-                            flags,
-                            rhc,
-                            (id, None, None)
-                            ]
-                    }
-                    )
-    rows.sort(key=itemgetter('sort'))
-    rdict = NDict()
-    for row in rows:
-        if using_groups:
-            groups = location2groups.get(row['location'], ['OTHER'])
-            for group in groups:
-                path = f"{group}/{row['location']}"
-                values = row['columns']
-                rdict.add(path, values)
-        else:
-            path = row['location']
-            values = row['columns']
-            rdict.add(path, values)
-    tree, row2id = rdict.as_tree(rdict, level=0)
-    return tree, row2id
+                {
+                    'id': id,
+                    'sort': (location, status, sort_priority, job_sort, job.get('summary', '')),
+                    'location': location,
+                    'path': location,
+                    'values': [
+                        job.get('status', ''),
+                        summary,
+                        '',
+                        rhc,
+                        (id, None, job_id)
+                        ]
+                }
+            )
+    else:
+        location = item.get('l', '~')
+        priority = int(item.get('p', 0))
+        extent = item.get('e', '')
+        extent = format_duration(extent) if extent else ""
+        sort_priority = 4 - int(priority)
+        show_priority = str(priority) if priority > 0 else ""
+        rhc = " ".join([show_priority, extent]).center(7, ' ')
+        rows.append(
+                {
+                    'id': id,
+                    'sort': (location, sort_priority, extent, item['summary']),
+                    'location': location,
+                    'path': location,
+                    'values': [
+                        item['itemtype'],
+                        item['summary'],
+                        '',
+                        rhc,
+                        (id, None, None)
+                        ]
+                }
+                )
+    return rows
+
+
+def next_paths():
+    """
+    When location groups are specified in settings, each row appears under group/location for each group containing its location. Otherwise None and rows appear under their location.
+    """
+    groups = settings.get('locations', {})
+    logger.debug(f"groups: {groups}")
+    if not groups:
+        return None
+    location2groups = {'~': ['OTHER']}
+    for group, locations in groups.items():
+        for location in locations:
+            location2groups.setdefault(location, []).append(group)
+    logger.debug(f"location2groups: {location2groups}")
+    def paths(row):
+        return [f"{group}/{row['location']}" for group in location2groups.get(row['location'], ['OTHER'])]
+    return paths
+
+
+def show_next(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+    """
+    Unfinished, undated tasks and jobs
+    """
+    rows = [row for item in db for row in next_rows(item)]
+    return render_rows(rows, pinned_list, link_list, konnect_list, timers, paths=next_paths())
+
+
+def journal_rows(item):
+    if item['itemtype'] != '%':
+        return []
+    id = item.doc_id
+    index = item.get('i', '~')
+    return [{
+            'id': id,
+            'sort': (index, item['summary']),
+            'path': index,
+            'values': [
+                item['itemtype'],
+                item['summary'],
+                '',
+                str(id).rjust(5, ' '),
+                id
+                ],
+            }]
 
 
 def show_journal(db, id2relevant, pinned_list=[], link_list=[], konnect_list=[], timers={}):
     """
     journal grouped by index entry
     """
-    width = shutil.get_terminal_size()[0] - 2
-    rows = []
-    summary_width = width - 14
-    # indices = set([])
-    for item in db:
-        id = item.doc_id
-        if item['itemtype'] != '%':
-            continue
-        rhc = str(id).rjust(5, ' ')
-        index = item.get('i', '~')
-        itemtype = item['itemtype']
-        summary = item['summary']
-        flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
+    rows = [row for item in db for row in journal_rows(item)]
+    return render_rows(rows, pinned_list, link_list, konnect_list, timers)
+
 
+def tags_rows(item):
+    id = item.doc_id
+    rhc = str(id).rjust(5, ' ')
+    rows = []
+    for tag in subsets(item.get('t', [])):
         rows.append({
-                    'sort': (index, item['summary']),
-                    'path': index,
+                    'id': id,
+                    'sort': (tag, item['itemtype'], item['summary']),
+                    'path': tag[1],
                     'values': [
-                        itemtype,
-                        summary,
-                        flags,
+                        item['itemtype'],
+                        item['summary'],
+                        '',
                         rhc,
                         id
                         ],
                     })
-    rows.sort(key=itemgetter('sort'))
-    rdict = NDict()
-    for row in rows:
-        path = row['path']
-        values = row['values']
-        rdict.add(path, values)
-    tree, row2id = rdict.as_tree(rdict, level=0)
-    return tree, row2id
+    return rows
 
 
 def show_tags(db, id2relevant, pinned_list=[], link_list=[], konnect_list=[], timers={}):
     """
     tagged items grouped by tag
     """
-    width = shutil.get_terminal_size()[0] - 2
-    rows = []
-    for item in db:
-        id = item.doc_id
-        rhc = str(id).rjust(5, ' ')
-        tags = item.get('t', [])
-        itemtype = item['itemtype']
-        summary = item['summary']
-        flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
+    rows = [row for item in db for row in tags_rows(item)]
+    return render_rows(rows, pinned_list, link_list, konnect_list, timers)
 
-        for tag in subsets(tags):
-            rows.append({
-                        'sort': (tag, item['itemtype'], item['summary']),
-                        'path': tag[1],
-                        'values': [
-                            itemtype,
-                            summary,
-                            flags,
-                            rhc,
-                            id
-                            ],
-                        })
-    rows.sort(key=itemgetter('sort'))
-    rdict = NDict()
-    for row in rows:
-        path = row['path']
-        values = row['values']
-        rdict.add(path, values)
-    tree, row2id = rdict.as_tree(rdict, level=0)
-    return tree, row2id
+
+def location_rows(item):
+    id = item.doc_id
+    location = item.get('l', '~')
+    return [{
+            'id': id,
+            'sort': (location, item['itemtype'], item['summary']),
+            'path': location,
+            'values': [
+                item['itemtype'],
+                item['summary'],
+                '',
+                str(id).rjust(5, ' '),
+                id
+                ],
+            }]
 
 
 def show_location(db, id2relevant, pinned_list=[], link_list=[], konnect_list=[], timers={}):
     """
     items with location entries grouped by location
     """
-    width = shutil.get_terminal_size()[0] - 2
-    rows = []
-    for item in db:
-        id = item.doc_id
-        rhc = str(id).rjust(5, ' ')
-        location = item.get('l', '~')
-        itemtype = item['itemtype']
-        summary = item['summary']
-        flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
+    rows = [row for item in db for row in location_rows(item)]
+    return render_rows(rows, pinned_list, link_list, konnect_list, timers)
 
-        rows.append({
-                    'sort': (location, item['itemtype'], item['summary']),
-                    'path': location,
-                    'values': [
-                        itemtype,
-                        summary,
-                        flags,
-                        rhc,
-                        id
-                        ],
-                    })
-    rows.sort(key=itemgetter('sort'))
-    rdict = NDict()
-    for row in rows:
-        path = row['path']
-        values = row['values']
-        rdict.add(path, values)
-    tree, row2id = rdict.as_tree(rdict, level=0)
-    return tree, row2id
+
+def index_rows(item):
+    id = item.doc_id
+    index = item.get('i', '~')
+    return [{
+            'id': id,
+            'sort': (index, item['summary']),
+            'path': index,
+            'values': [
+                item['itemtype'],
+                item['summary'],
+                '',
+                str(id).rjust(5, ' '),
+                id
+                ],
+            }]
 
 
 def show_index(db, id2relevant, pinned_list=[], link_list=[], konnect_list=[], timers={}):
     """
     All items grouped by index entry
     """
-    rows = []
-    for item in db:
-        # if item['itemtype'] == '%':
-        #     continue
-        id = item.doc_id
-        rhc = str(id).rjust(5, ' ')
-        index = item.get('i', '~')
-        itemtype = item['itemtype']
-        # index_tup = index.split('/')
-        summary = item['summary']
-        flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
-        rows.append({
-                    'sort': (index, item['summary']),
-                    'path': index,
-                    'values': [
-                        itemtype,
-                        summary,
-                        flags,
-                        rhc,
-                        id],
-                    })
-    rows.sort(key=itemgetter('sort'))
-    rdict = NDict()
-    for row in rows:
-        path = row['path']
-        values = row['values']
-        try:
-            rdict.add(path, values)
-        except:
-            logger.error(f"error adding path: {path}, values: {values}")
-    tree, row2id = rdict.as_tree(rdict, level=0)
-    return tree, row2id
+    rows = [row for item in db for row in index_rows(item)]
+    return render_rows(rows, pinned_list, link_list, konnect_list, timers)
 
 
 def show_pinned(items, pinned_list=[], link_list=[], konnect_list=[], timers={}):
@@ -5911,74 +6204,67 @@ def show_pinned(items, pinned_list=[], link_list=[], konnect_list=[], timers={})
     tree, row2id = rdict.as_tree(rdict, level=0)
     return tree, row2id
 
-def get_usedtime(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+def usedtime_rows(item, UT_MIN=1):
     """
-    All items with used entries grouped by month, index entry and day
-
+    Return the used time detail rows and the totals in minutes keyed by (month, *index) for a single item.
     """
-    UT_MIN = settings.get('usedtime_minutes', 1)
+    detail_rows = []
+    used_time = {}
+    used = item.get('u') # this will be a list of 'period, datetime' tuples
+    if not used:
+        return detail_rows, used_time
+    index = item.get('i', '~')
+    id_used = {}
+    index_tup = index.split('/')
+    id = item.doc_id
+    itemtype = item['itemtype']
+    summary = item['summary']
+
+    for period, dt in used:
+        # whole minutes, rounded up to UT_MIN
+        minutes = data.used_minutes(period, UT_MIN)
+        monthday = dt if not isinstance(dt, pendulum.DateTime) else dt.date()
+        id_used[monthday] = id_used.get(monthday, 0) + minutes
+        # for used_time
+        month = monthday.format("YYYY-MM")
+        used_time[(month, )] = used_time.get((month, ), 0) + minutes
+        for i in range(len(index_tup)):
+            key = (month, *index_tup[:i+1])
+            used_time[key] = used_time.get(key, 0) + minutes
+    for monthday in id_used:
+        month = monthday.format("YYYY-MM")
+        rhc = f"{monthday.format('MMM D')}: {format_hours_and_tenths(id_used[monthday] * ONEMIN)}".ljust(14, ' ')
+        detail_rows.append({
+                    'id': id,
+                    'sort': (month, *index_tup, monthday, itemtype, summary),
+                    'month': month,
+                    'path': f"{monthday.format('MMMM YYYY')}/{index}",
+                    'values': [
+                        itemtype,
+                        summary,
+                        '',
+                        rhc,
+                        id],
+                    })
+    return detail_rows, used_time
+
 
+def usedtime_views(detail_rows, used_time, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+    """
+    Render the used time details and summaries for each month from the combined rows and totals of usedtime_rows.
+    """
     width = shutil.get_terminal_size()[0] - 2
     summary_width = width - 21
 
     used_details = {}
     used_details2id = {}
     used_summary = {}
-
     month_rows = {}
-    used_time = {}
-    detail_rows = []
-    months = set([])
-    for item in db:
-        used = item.get('u') # this will be a list of 'period, datetime' tuples
-        if not used:
-            continue
-        index = item.get('i', '~')
-        id_used = {}
-        index_tup = index.split('/')
-        id = item.doc_id
-        itemtype = item['itemtype']
-        summary = item['summary']
-        flags = get_flags(id, link_list, konnect_list, pinned_list, timers)
-
-        for period, dt in used:
-            if isinstance(dt, pendulum.Date) and not isinstance(dt, pendulum.DateTime):
-                dt = pendulum.parse(dt.format("YYYYMMDD"), tz='local')
-                dt.set(hour=23, minute=59, second=59)
-            # for id2used
-            if UT_MIN != 1:
-                res = period.minutes % UT_MIN
-                if res:
-                    period += (UT_MIN - res) * ONEMIN
-
-            monthday = dt.date()
-            id_used.setdefault(monthday, ZERO)
-            id_used[monthday] += period
-            # for used_time
-            month = dt.format("YYYY-MM")
-            used_time.setdefault(tuple((month,)), ZERO)
-            used_time[tuple((month, ))] += period
-            for i in range(len(index_tup)):
-                used_time.setdefault(tuple((month, *index_tup[:i+1])), ZERO)
-                used_time[tuple((month, *index_tup[:i+1]))] += period
-        for monthday in id_used:
-            month = monthday.format("YYYY-MM")
-            rhc = f"{monthday.format('MMM D')}: {format_hours_and_tenths(id_used[monthday])}".ljust(14, ' ')
-            detail_rows.append({
-                        'sort': (month, *index_tup, monthday, itemtype, summary),
-                        'month': month,
-                        'path': f"{monthday.format('MMMM YYYY')}/{index}",
-                        'values': [
-                            itemtype,
-                            summary,
-                            flags,
-                            rhc,
-                            id],
-                        })
 
+    for row in detail_rows:
+        row['values'][2] = get_flags(row['id'], link_list, konnect_list, pinned_list, timers)
     detail_rows.sort(key=itemgetter('sort'))
     for month, items in groupby(detail_rows, key=itemgetter('month')):
-        months.add(month)
         rdict = NDict()
         for row in items:
             path = row['path']
@@ -5994,7 +6280,7 @@ def get_usedtime(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
     keys = [x for x in used_time]
     keys.sort()
     for key in keys:
-        period = used_time[key]
+        period = used_time[key] * ONEMIN
         month_rows.setdefault(key[0], [])
         indent = (len(key) - 1) * 3 * " "
         if len(key) == 1:
@@ -6017,6 +6303,164 @@ def get_usedtime(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
     return used_details, used_details2id, used_summary
 
 
+def get_usedtime(db, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+    """
+    All items with used entries grouped by month, index entry and day
+
+    """
+    UT_MIN = settings.get('usedtime_minutes', 1)
+    detail_rows = []
+    used_time = {}
+    for item in db:
+        rows, times = usedtime_rows(item, UT_MIN)
+        detail_rows.extend(rows)
+        for key, period in times.items():
+            used_time[key] = used_time.get(key, 0) + period
+    return usedtime_views(detail_rows, used_time, pinned_list, link_list, konnect_list, timers)
+
+
+class ViewRows(object):
+    """
+    Materialised rows for the db-derived views keyed by doc_id. A single pass over the documents builds the rows for all the views at once so that switching views only requires rendering the stored rows rather than another scan of the database. Thereafter, DataView.changed keeps the rows current by calling update for each changed document.
+    """
+
+    builders = {
+            'history': history_rows,
+            'review': review_rows,
+            'do next': next_rows,
+            'journal': journal_rows,
+            'tags': tags_rows,
+            'index': index_rows,
+            'location': location_rows,
+            }
+
+    def __init__(self):
+        self.rows = {}      # doc_id -> view -> rows
+        self.used = {}      # doc_id -> (detail_rows, used_time)
+        self.items = {}     # doc_id -> itemtype and summary for show_timers
+        self.rendered = {}  # view -> (key, (tree, row2id))
+        self.version = 0
+        self.clear_used()
+
+    def clear_used(self):
+        # the used time rollups: month -> (month, *index) -> total and
+        # the number of items contributing to it
+        self.used_time = {}
+        self.used_refs = {}
+        self.used_months = {}   # month -> doc_ids with used time in month
+        self.used_dirty = set() # months to render again
+        self.used_key = None
+        self.used_details = {}
+        self.used_details2id = {}
+        self.used_summary = {}
+
+    def refresh(self, db):
+        """
+        Rebuild the rows for every view in a single pass over db.
+        """
+        self.rows = {}
+        self.used = {}
+        self.items = {}
+        self.clear_used()
+        UT_MIN = settings.get('usedtime_minutes', 1)
+        for item in db:
+            self.add(item, UT_MIN)
+        self.version += 1
+
+    def add(self, item, UT_MIN=1):
+        id = item.doc_id
+        self.rows[id] = {view: builder(item) for view, builder in self.builders.items()}
+        self.items[id] = {'itemtype': item.get('itemtype', '?'), 'summary': item.get('summary', '')}
+        if item.get('u'):
+            self.used[id] = usedtime_rows(item, UT_MIN)
+            self.rollup(id, 1)
+
+    def rollup(self, doc_id, sign):
+        """
+        Add (sign 1) or subtract (sign -1) the used times of doc_id to or from the monthly totals and mark the months involved for rendering.
+        """
+        rows, times = self.used[doc_id]
+        for key, period in times.items():
+            month = key[0]
+            totals = self.used_time.setdefault(month, {})
+            refs = self.used_refs.setdefault(month, {})
+            refs[key] = refs.get(key, 0) + sign
+            if refs[key]:
+                totals[key] = totals.get(key, 0) + sign * period
+            else:
+                del refs[key]
+                del totals[key]
+            if sign > 0:
+                self.used_months.setdefault(month, set()).add(doc_id)
+            else:
+                self.used_months[month].discard(doc_id)
+            self.used_dirty.add(month)
+
+    def update(self, doc_id, item=None):
+        """
+        Replace the rows for doc_id with those for item or, if item is None, remove them.
+        """
+        if doc_id in self.used:
+            self.rollup(doc_id, -1)
+        for hsh in [self.rows, self.used, self.items]:
+            if doc_id in hsh:
+                del hsh[doc_id]
+        if item is not None:
+            self.add(item, settings.get('usedtime_minutes', 1))
+        self.version += 1
+
+    def get(self, doc_id=None):
+        """
+        Stand in for db.get in show_timers.
+        """
+        return self.items.get(doc_id, None)
+
+    def render(self, view, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+        """
+        Return tree, row2id for view, reusing the last rendering if neither the rows nor the flags have changed since.
+        """
+        key = (self.version, shutil.get_terminal_size()[0], pendulum.today().format("YYYYMMDD"), tuple(pinned_list), tuple(link_list), tuple(konnect_list), tuple(timers))
+        if view in self.rendered and self.rendered[view][0] == key:
+            return self.rendered[view][1]
+        rows = [row for id in self.rows for row in self.rows[id][view]]
+        if view == 'history':
+            res = render_rows(rows, pinned_list, link_list, konnect_list, timers, reverse=True)
+        elif view == 'review':
+            res = render_rows(rows, pinned_list, link_list, konnect_list, timers, paths=review_paths())
+        elif view == 'do next':
+            res = render_rows(rows, pinned_list, link_list, konnect_list, timers, paths=next_paths())
+        else:
+            res = render_rows(rows, pinned_list, link_list, konnect_list, timers)
+        self.rendered[view] = (key, res)
+        return res
+
+    def usedtime(self, pinned_list=[], link_list=[], konnect_list=[], timers={}):
+        """
+        Return used_details, used_details2id and used_summary from the monthly rollups, rendering again only the months that have changed since the last call - or every month if the flags or the terminal width have changed.
+        """
+        key = (shutil.get_terminal_size()[0], tuple(pinned_list), tuple(link_list), tuple(konnect_list), tuple(timers))
+        if key != self.used_key:
+            self.used_key = key
+            self.used_dirty = set(self.used_months)
+        for month in self.used_dirty:
+            for hsh in [self.used_details, self.used_details2id, self.used_summary]:
+                if month in hsh:
+                    del hsh[month]
+            ids = self.used_months.get(month)
+            if not ids:
+                self.used_months.pop(month, None)
+                self.used_time.pop(month, None)
+                self.used_refs.pop(month, None)
+                continue
+            detail_rows = [row for id in ids for row in self.used[id][0] if row['month'] == month]
+            details, details2id, summary = usedtime_views(detail_rows, self.used_time[month], pinned_list, link_list, konnect_list, timers)
+            self.used_details.update(details)
+            self.used_details2id.update(details2id)
+            self.used_summary.update(summary)
+        self.used_dirty = set()
+        return self.used_details, self.used_details2id, self.used_summary
+
+
 def fmt_class(txt, cls=None, plain=False):
     if not plain and cls is not None:
         return cls, txt
@@ -6126,23 +6570,16 @@ def schedule(db, yw=getWeekNum(), current=[], now=pendulum.now(), weeks_before=0
         if 'u' in item:
             used = item.get('u') # this will be a list of @u entries
             itemtype = item['itemtype']
-            dates_to_periods = {}
+            dates_to_minutes = {}
             for period, dt in used:
                 if isinstance(dt, pendulum.Date) and not isinstance(dt, pendulum.DateTime):
                     pass
                 else:
                     dt = dt.date()
-                if UT_MIN != 1:
-                    # round up minutes
-                    res = period.minutes % UT_MIN
-                    if res:
-                        period += (UT_MIN - res) * ONEMIN
-                dates_to_periods.setdefault(dt, []).append(period)
-            for dt in dates_to_periods:
-                total = ZERO
-                for p in dates_to_periods[dt]:
-                    total += p
-                rhc = format_hours_and_tenths(total).center(rhc_width, ' ')
+                # whole minutes, rounded up to UT_MIN
+                dates_to_minutes[dt] = dates_to_minutes.get(dt, 0) + data.used_minutes(period, UT_MIN)
+            for dt in dates_to_minutes:
+                rhc = format_hours_and_tenths(dates_to_minutes[dt] * ONEMIN).center(rhc_width, ' ')
                 done.append(
                         {
                             'id': id,
@@ -6414,7 +6851,7 @@ def schedule(db, yw=getWeekNum(), current=[], now=pendulum.now(), weeks_before=0
     return cache
 
 
-def import_file(import_file=None):
+def import_file(import_file=None, progress=None):
     if not import_file:
         return False, ""
     import_file = os.path.normpath(os.path.expanduser(import_file))
@@ -6426,47 +6863,77 @@ def import_file(import_file=None):
     elif extension == '.text':
         return True, import_text(import_file)
     elif extension == '.ics':
-        return True, import_ics(import_file)
+        return True, import_ics(import_file, progress)
+    elif extension == '.jsonl':
+        return True, import_jsonl(import_file, progress)
     else:
-        return False, f"Importing a file with the extension '{extension}' is not implemented. Only 'json', 'text' and 'ics' are recognized"
+        return False, f"Importing a file with the extension '{extension}' is not implemented. Only 'json', 'text', 'ics' and 'jsonl' are recognized"
+
+
+IMPORT_USAGE = """\
+usage: etm [loglevel] [etmdir] import [--jsonl] <file> [<file> ...]
+
+Import each file into the items table without starting the user
+interface. Files with the extensions '.json' (exported from etm
+3.2.x), '.text' (etm entries), '.ics' (iCalendar) and '.jsonl'
+(written by 'etm export --jsonl') are recognized. With --jsonl,
+each file is read as JSON lines whatever its extension. Items
+that duplicate existing items are rejected.
+"""
 
 
-def import_ics(import_file=None):
+def batch_import(args, out=sys.stdout):
     """
-    open ics file and convert it to text file in tempdir. Then import the text file using
+    The 'etm import' command. Returns an error message, if any, for sys.exit.
     """
-    items = ical.ics_to_items(import_file)
-    if not items:
-        return
-    # check for dups
-    exst = []
-    new = []
-    dups = 0
-    for x in ETMDB:
-        exst.append({
-                    'itemtype': x.get('itemtype'),
-                    'summary': x.get('summary'),
-                    's': x.get('s'),
-                    # 'f': x.get('f')
-                    })
-    num_docs = len(items.keys())
-    for i, x  in items.items():
-        y = {
-                    'itemtype': x.get('itemtype'),
-                    'summary': x.get('summary'),
-                    's': x.get('s'),
-                    # 'f': x.get('f')
-                    }
-        if exst and y in exst:
-            dups += 1
+    if not args or args[0] in ['?', 'help']:
+        return IMPORT_USAGE
+    jsonl = args[0] == '--jsonl'
+    if jsonl:
+        args = args[1:]
+    failed = []
+    for path in args:
+        def progress(imported):
+            print(f"{path}: imported {imported} items", file=sys.stderr)
+        if jsonl and os.path.exists(os.path.expanduser(path)):
+            ok, msg = True, import_jsonl(os.path.expanduser(path), progress)
         else:
-            x['created'] = pendulum.now()
-            new.append(x)
+            ok, msg = import_file(path, progress)
+        print(f"{path}: {msg}" if msg else path, file=out)
+        if not ok:
+            failed.append(path)
+    if failed:
+        return f"could not import: {', '.join(failed)}"
+    return None
+
 
+def insert_batches(items, size=1000):
+    """
+    After rejecting duplicates, insert the hashes generated by items using insert_multiple for each batch of size items so that at most one batch is held in memory. After each batch generate the running totals (imported, duplicates, ids).
+    """
+    dup_index = DuplicateIndex()
+    batch = []
+    imported = dups = 0
     ids = []
-    if new:
-        ids = ETMDB.insert_multiple(new)
-    msg = f"imported {len(new)} items"
+    for x in items:
+        if dup_index.is_duplicate(x):
+            dups += 1
+            continue
+        dup_index.add(x)
+        batch.append(x)
+        if len(batch) >= size:
+            ids.extend(DBITEM.insert_multiple(batch))
+            imported += len(batch)
+            batch = []
+            yield imported, dups, ids
+    if batch:
+        ids.extend(DBITEM.insert_multiple(batch))
+        imported += len(batch)
+    yield imported, dups, ids
+
+
+def import_message(imported, dups, ids):
+    msg = f"imported {imported} items"
     if ids:
         msg += f"\n  ids: {ids[0]}-{ids[-1]}."
     if dups:
@@ -6474,55 +6941,118 @@ def import_ics(import_file=None):
     return msg
 
 
+def import_batches(batches, progress=None):
+    """
+    Consume the running totals from batches, calling progress, if given, with the number of items imported after each batch, and return the summary message.
+    """
+    imported, dups, ids = 0, 0, []
+    for imported, dups, ids in batches:
+        if progress:
+            progress(imported)
+    return import_message(imported, dups, ids)
+
+
+def import_ics_batches(import_file, size=1000):
+    """
+    Read the components of the ics file import_file one at a time and insert the resulting items in batches.
+    """
+    now = pendulum.now()
+    def items():
+        for x in ical.iter_ics_items(import_file):
+            x['created'] = now
+            yield x
+    return insert_batches(items(), size)
+
+
+def import_ics(import_file=None, progress=None):
+    return import_batches(import_ics_batches(import_file), progress)
+
+
+def iter_jsonl_items(import_file):
+    """
+    Generate the documents from a file written by 'etm export --jsonl' one line at a time. The exported ids are dropped since the documents receive new ids and, for the same reason, so are @k konnections.
+    """
+    now = pendulum.now('local')
+    with open(import_file, 'r') as fo:
+        for num, line in enumerate(fo, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                hsh = data.decode_value(json.loads(line))
+            except Exception as e:
+                logger.error(f"skipping line {num} of {import_file}: {e}")
+                continue
+            if not (isinstance(hsh, dict) and hsh.get('itemtype') and hsh.get('summary')):
+                logger.error(f"skipping line {num} of {import_file}: missing itemtype or summary")
+                continue
+            hsh.pop('id', None)
+            hsh.pop('k', None)
+            hsh.setdefault('created', now)
+            yield hsh
+
+
+def import_jsonl_batches(import_file, size=1000):
+    return insert_batches(iter_jsonl_items(import_file), size)
+
+
+def import_jsonl(import_file=None, progress=None):
+    return import_batches(import_jsonl_batches(import_file), progress)
+
+
 def import_text(import_file=None):
-    docs = []
+    """
+    Parse the reminders in import_file with a single Item and store the good ones with one insert_multiple. Reminders that fail to parse are reported with the number of the line on which they begin and duplicates are rejected.
+    """
+    reminders = []
     with open(import_file, 'r') as fo:
-        results = []
-        good = []
-        bad = 0
-        reminders = []
         reminder = []
-        for line in fo:
+        start = 1
+        for num, line in enumerate(fo, 1):
             s = line.strip()
             if s and s[0] in ['!', '*', '+', '%']:
                 if reminder:
                     # append it to reminders and reset it
-                    reminders.append(reminder)
-                    reminder = []
+                    reminders.append((start, reminder))
                 reminder = [s]
+                start = num
             else:
                 # append to the existing reminder
+                if not reminder:
+                    start = num
                 reminder.append(s)
         if reminder:
-            reminders.append(reminder)
-    for reminder in reminders:
-        ok = True
-        s = "\n".join(reminder)
-        if not s: continue
-        item = Item()  # use ETMDB by default
-        item.new_item()
-        item.text_changed(s, 1)
-        if item.item_hsh.get('itemtype', None) is None:
-            ok = False
-
-        if item.item_hsh.get('summary', None) is None:
-            ok = False
+            reminders.append((start, reminder))
 
+    parser = Item()  # use DBITEM by default
+    dup_index = DuplicateIndex()
+    now = pendulum.now('local')
+    docs = []
+    results = []
+    dups = 0
+    for num, reminder in reminders:
+        s = "\n".join(reminder)
+        if not s.strip(): continue
+        ok, res = parser.parse_entry(s)
         if not ok:
-            bad += 1
-            results.append(f"   {s}")
+            entry = s.replace("\n", "\n    ")
+            results.append(f"line {num}: {res}\n    {entry}")
             continue
+        if dup_index.is_duplicate(res):
+            dups += 1
+            continue
+        dup_index.add(res)
+        res['created'] = now
+        docs.append(res)
 
-        # update_item_hsh stores the item in ETMDB
-        item.update_item_hsh()
-        good.append(f"{item.doc_id}")
-
-    res = f"imported {len(good)} items"
-    if good:
-        # ids = ETMDB.insert_multiple(docs)
-        res += f"\n  ids: {good[0]} - {good[-1]}"
-    if bad:
-        res += f"\nrejected {bad} items:\n  "
+    ids = DBITEM.insert_multiple(docs) if docs else []
+    res = f"imported {len(ids)} items"
+    if ids:
+        res += f"\n  ids: {ids[0]} - {ids[-1]}"
+    if dups:
+        res += f"\n  rejected {dups} items as duplicates"
+    if results:
+        res += f"\nrejected {len(results)} items:\n  "
         res += "\n  ".join(results)
     return res
 
@@ -6641,33 +7171,11 @@ def import_json(import_file=None):
 
         docs.append(item_hsh)
     # now check for duplicates. If an item to be imported has the same type, summary and starting time as an existing item, regard it as a duplicate and do not import it.
-    exst = []
-    new = []
-    dups = 0
-    for x in ETMDB:
-        exst.append({
-                    'itemtype': x.get('itemtype'),
-                    'summary': x.get('summary'),
-                    's': x.get('s'),
-                    # 'f': x.get('f')
-                    })
-    i = 0
-    for x in docs:
-        i += 1
-        y = {
-                    'itemtype': x.get('itemtype'),
-                    'summary': x.get('summary'),
-                    's': x.get('s'),
-                    # 'f': x.get('f')
-                    }
-        if exst and y in exst:
-            dups += 1
-        else:
-            new.append(x)
+    new, dups = DuplicateIndex().split(docs)
 
     ids = []
     if new:
-        ids = ETMDB.insert_multiple(new)
+        ids = DBITEM.insert_multiple(new)
     msg = f"imported {len(new)} items"
     if ids:
         msg += f"\n  ids: {ids[0]}-{ids[-1]}."
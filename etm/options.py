@@ -138,6 +138,13 @@ keep_current: 0
 # pCloud or DropBox folder for access from your mobile device.
 keep_next: false
 
+# keep_ics: true or false. If true, the unfinished and finished
+# events, tasks and journal entries will be exported to
+# "items.ics" in your etm home directory and the file will be
+# updated whenever the items change. A calendar application
+# or CalDAV server could, for example, subscribe to this file.
+keep_ics: false
+
 # archive_after: A non-negative integer. If zero, do not
 # archive items. If positive, finished tasks and events with
 # last datetimes falling more than this number of years
@@ -267,6 +274,16 @@ queries:
   # the query)
     find: includes summary d
 
+# materialize: A list of keys from "queries" with each key
+# indented on a separate line. The items matching each of
+# these queries are found when etm starts and are then kept
+# current as items are changed. The number matching each
+# is displayed in the status bar and submitting the query
+# requires no search. For a complex query, the items
+# matching its -q query are materialized. Update queries
+# are not materialized.
+materialize:
+
 # style: dark or light. Designed for, respectively, dark or
 # light terminal backgounds. Some output may not be visible
 # unless this is set correctly for your display.
@@ -431,6 +448,10 @@ locations:
             new['vi_mode'] = self.settings['vi_mode']
             changed.append(f"retaining default for 'vi_mode': {self.settings['vi_mode']}")
 
+        if new['materialize'] and not isinstance(new['materialize'], list):
+            new['materialize'] = [new['materialize']]
+            changed.append(f"converting 'materialize' to the list {new['materialize']}")
+
         if isinstance(new['keep_current'], bool):
             new['keep_current'] = 3 if new['keep_current'] else 0
             changed.append(f"Converting 'keep_current' from boolian to integer {new['keep_current']}")
@@ -5,7 +5,6 @@ import shutil
 import textwrap
 import re
 from pprint import pprint
-from copy import deepcopy
 from tinydb import where, Query
 from prompt_toolkit import prompt
 from prompt_toolkit import PromptSession
@@ -26,9 +25,13 @@ import pendulum
 from pendulum import parse
 from pendulum import duration
 import itertools
+from datetime import date
 from itertools import groupby
 flatten = itertools.chain.from_iterable
 from operator import itemgetter
+from functools import lru_cache
+import json
+import csv
 
 ZERO = duration(minutes=0)
 ONEMIN = duration(minutes=1)
@@ -158,6 +161,7 @@ def earlier(d1, d2):
         return "only pendulum dates or datetimes can be compared"
     return _fmtdt(d1) < _fmtdt(d2)
 
+@lru_cache(maxsize=1024)
 def format_week(dt, fmt="WWW"):
     """
     """
@@ -192,6 +196,36 @@ def format_week(dt, fmt="WWW"):
     return f"{week_begin} - {week_end}{year_week}{add_comma}"
 
 
+@lru_cache(maxsize=4096)
+def rdt_format(rdt, fmt):
+    """
+    Memoised rdt.format(fmt) for the group/sort expressions. Many items in a report share the same rdt.
+    """
+    return rdt.format(fmt)
+
+
+@lru_cache(maxsize=1024)
+def rdt_strftime(rdt, fmt):
+    return rdt.strftime(fmt)
+
+
+def compile_expressions(exprs):
+    """
+    Compile the expressions from get_grpby_and_filters once per report into functions of item. A list of expressions becomes a function returning their space separated values.
+    """
+    env = {'re': re, 'format_week': format_week, 'rdt_format': rdt_format, 'rdt_strftime': rdt_strftime}
+    funcs = []
+    for x in exprs:
+        if not x:
+            continue
+        if isinstance(x, list):
+            parts = compile_expressions(x)
+            funcs.append(lambda item, parts=parts: " ".join([f(item) for f in parts]))
+        else:
+            funcs.append(eval(f"lambda item: {x}", env))
+    return funcs
+
+
 def maybe_round(obj):
     """
     round up to the nearest UT_MIN minutes.
@@ -230,113 +264,122 @@ def sort_dates_times(obj):
         return obj
 
 
-def apply_dates_filter(items, grpby, filters):
+class ReportRow(object):
+    """
+    A report row for a document. Lookups fall through to the document itself while rdt, the collapsed u entry for used time reports and the defaults provided by get_output_and_row2id are stored in the row. Rows thus share their document rather than each holding a copy.
+    """
+    __slots__ = ('doc', 'fields')
+
+    def __init__(self, doc, **fields):
+        self.doc = doc
+        self.fields = fields
+
+    @property
+    def doc_id(self):
+        return self.doc.doc_id
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return self.fields[key]
+        return self.doc[key]
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+
+    def __contains__(self, key):
+        return key in self.fields or key in self.doc
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.fields[key] = default
+        return self[key]
+
+    def __repr__(self):
+        return f"ReportRow({self.doc_id}, {self.fields})"
+
+
+@lru_cache(maxsize=4096)
+def ordinal_date(day):
+    d = date.fromordinal(day)
+    return pendulum.date(d.year, d.month, d.day)
+
+
+def apply_dates_filter(items, grpby, filters, used=None):
+    """
+    Return a ReportRow for each of items, or for used time reports, for each day for which the item has used time. For the latter, used, if given, is the data.UsedTimes store for the table from which items were taken and the daily totals are read from it.
+    """
     logger.debug(f"starting len(items): {len(items)}; filters: {filters}")
+    b = filters.get('b')
+    e = filters.get('e')
+    if grpby['report'] == 'u' and used is not None:
+        totals = used.totals(
+                None if b is None else data.minute_stamp(b),
+                None if e is None else data.minute_stamp(e),
+                set([item.doc_id for item in items]),
+                UT_MIN)
+        days = {}
+        for (doc_id, day), minutes in totals.items():
+            days.setdefault(doc_id, []).append((day, minutes))
+        ok_items = []
+        for item in items:
+            for day, minutes in days.get(item.doc_id, []):
+                rdt = ordinal_date(day)
+                ok_items.append(ReportRow(item, rdt=rdt, u=[rdt, minutes * ONEMIN]))
+        logger.debug(f"ending len(ok_items): {len(ok_items)}")
+        return ok_items
+
     if grpby['report'] == 'u':
-        def rel_dt(item, filters):
-            rdts = []
-            ok = False
-            used_times = deepcopy(item['u'])
-            drop = []
-            if 'b' in filters and 'e' in filters: # both b and e
-                for x in used_times:
-                    if earlier(x[1], filters['b']) or later(x[1], filters['e']):
-                        drop.append(x)
-            elif 'b' in filters: # only b
-                for x in used_times:
-                    if earlier(x[1], filters['b']):
-                        drop.append(x)
-            elif 'e' in filters: # only e
-                for x in used_times:
-                    if later(x[1], filters['e']):
-                        drop.append(x)
-            if drop:
-                for x in drop:
-                    used_times.remove(x)
-            items = []
+        def rel_dt(item):
             dt2ut = {}
-            for x in used_times:
-                rdt = x[1] if isinstance(x[1], pendulum.Date) else x[1].date()
+            for x in item['u']:
+                if (b is not None and earlier(x[1], b)) or (e is not None and later(x[1], e)):
+                    continue
+                rdt = x[1].date() if isinstance(x[1], pendulum.DateTime) else x[1]
                 dt2ut.setdefault(rdt, ZERO)
                 dt2ut[rdt] += maybe_round(x[0])
-            for rdt in dt2ut:
-                tmp = deepcopy(item)
-                tmp['rdt'] = rdt
-                tmp['u'] = [rdt, dt2ut[rdt]]
-                items.append(tmp)
-            return items
+            return [ReportRow(item, rdt=rdt, u=[rdt, ut]) for rdt, ut in dt2ut.items()]
 
     elif grpby['report'] == 's':
-        def rel_dt(item, filters):
-            ok = False
-            items = []
-            tmp = deepcopy(item)
+        def rel_dt(item):
             rdt = None
             if 'f' in item:
                 rdt = item['f'] if isinstance(item['f'], pendulum.Date) else item['f'].date()
-                # e_ok = 'e' not in filters or item['f'] <= filters['e']
-                e_ok = 'e' not in filters or not later(item['f'], filters['e'])
-                # b_ok = 'b' not in filters or item['f'] >= filters['b']
-                b_ok = not ('b' in filters and earlier(item['f'], filters['b']))
+                e_ok = e is None or not later(item['f'], e)
+                b_ok = b is None or not earlier(item['f'], b)
             elif 's' in item:
                 rdt = item['s'] if isinstance(item['s'], pendulum.Date) else item['s'].date()
-                # e_ok = 'e' not in filters or rdt <= filters['e']
-                e_ok = not ('e' in filters and later(item['s'], filters['e']))
-                # b_ok = 'b' not in filters or rdt >= filters['b']
-                b_ok = 'b' not in filters or not earlier(item['s'], filters['b'])
+                e_ok = e is None or not later(item['s'], e)
+                b_ok = b is None or not earlier(item['s'], b)
             else:
                 e_ok = b_ok = True
             if e_ok and b_ok:
                 if grpby['dated']:
                     if rdt:
-                        tmp['rdt'] = rdt
-                        items.append(tmp)
+                        return [ReportRow(item, rdt=rdt)]
                 else:
                     # not dated, don't need rdt
-                    items.append(tmp)
-            return items
-
-    elif grpby['report'] == 'c':
-        def rel_dt(item, filters):
-            ok = False
-            items = []
-            tmp = deepcopy(item)
-            rdt = item['created']
-            # e_ok = 'e' not in filters or rdt <= filters['e']
-            e_ok = 'e' not in filters or not later(rdt, filters['e'])
-            # b_ok = 'b' not in filters or rdt >= filters['b']
-            b_ok = 'b' not in filters or not earlier(rdt, filters['b'])
+                    return [ReportRow(item)]
+            return []
+
+    elif grpby['report'] in ['c', 'm']:
+        def rel_dt(item):
+            rdt = item['created'] if grpby['report'] == 'c' else item.get('modified', item['created'])
+            e_ok = e is None or not later(rdt, e)
+            b_ok = b is None or not earlier(rdt, b)
             if e_ok and b_ok:
                 if rdt:
-                    tmp['rdt'] = rdt
-                    items.append(tmp)
+                    return [ReportRow(item, rdt=rdt)]
                 else:
                     # not dated, don't need rdt
-                    items.append(tmp)
-            return items
-
-    elif grpby['report'] == 'm':
-        def rel_dt(item, filters):
-            ok = False
-            items = []
-            tmp = deepcopy(item)
-            rdt = item.get('modified', item['created'])
-            # e_ok = 'e' not in filters or rdt <= filters['e']
-            e_ok = 'e' not in filters or not later(rdt, filters['e'])
-            # b_ok = 'b' not in filters or rdt >= filters['b']
-            b_ok = 'b' not in filters or not earlier(rdt, filters['b'])
-            if e_ok and b_ok:
-                if rdt:
-                    tmp['rdt'] = rdt
-                    items.append(tmp)
-                else:
-                    # not dated, don't need rdt
-                    items.append(tmp)
-            return items
+                    return [ReportRow(item)]
+            return []
 
     ok_items = []
     for item in items:
-        ok_items.extend(rel_dt(item, filters))
+        ok_items.extend(rel_dt(item))
     logger.debug(f"ending len(ok_items): {len(ok_items)}")
     return ok_items
 
@@ -456,37 +499,30 @@ class QDict(dict):
         return "\n  ".join(self.output), self.row2id
 
 
-def get_output_and_row2id(items, grpby, header=""):
-    logger.debug(f"grpby: {grpby}; header: {header}")
+def report_rows(items, grpby):
+    """
+    Return the sorted (path, details) rows for items together with the used times for each path prefix in 'u' reports.
+    """
     used_time = {}
     ret = []
     report = grpby['report']
-    sort_tups = [x for x in grpby.get('sort', [])]
-    path_tups = [x for x in grpby.get('path', [])]
-    dtls_tups  = [x for x in grpby.get('dtls', [])]
+    sort_funcs = compile_expressions(grpby.get('sort', []))
+    path_funcs = compile_expressions(grpby.get('path', []))
+    dtls_tups = [x for x in grpby.get('dtls', []) if x]
+    dtls_funcs = compile_expressions(dtls_tups)
     for item in items:
         for x in ['i', 'c', 'l']:
             item.setdefault(x, '~') # make ~ the default
         item.setdefault('modified', item['created'])
         if 'f' in item:
             item['itemtype'] = '-' if report == 'u' else finished_char
-        st = [eval(x, {'item': item, 're': re, 'format_week': format_week}) for x in sort_tups if x]
-        # pt = [eval(x, {'item': item, 're': re, 'format_week': format_week}) for x in path_tups if x]
-        pt = []
-        for y in path_tups:
-            if not y:
-                continue
-            if isinstance(y, list):
-                pt.append(" ".join([eval(x, {'item': item, 're': re, 'format_week': format_week}) for x in y if x]))
-            else:
-                pt.append(eval(y, {'item': item, 're': re, 'format_week': format_week}))
+        st = [f(item) for f in sort_funcs]
+        pt = [f(item) for f in path_funcs]
 
         dt = []
-        for x in dtls_tups:
-            if not x:
-                continue
+        for x, f in zip(dtls_tups, dtls_funcs):
             try:
-                dt.append(eval(x, {'item': item, 're': re}))
+                dt.append(f(item))
             except Exception as e:
                 logger.error(f"error: {e}, evaluating {x}")
         if grpby['report'] == 'u':
@@ -498,7 +534,12 @@ def get_output_and_row2id(items, grpby, header=""):
         ret.append((st, pt, dt))
     ret.sort(key=lambda x: x[0])
 
-    ret = [x[1:] for x in ret]
+    return [x[1:] for x in ret], used_time
+
+
+def get_output_and_row2id(items, grpby, header=""):
+    logger.debug(f"grpby: {grpby}; header: {header}")
+    ret, used_time = report_rows(items, grpby)
 
     # create recursive dict from data
     row = 1 if header else 0
@@ -556,19 +597,19 @@ def get_grpby_and_filters(s, options=None):
                 this_path = []
                 for part in gparts:
                     if 'W' in part:
-                        this_sort.append("item['rdt'].strftime('%W')")
+                        this_sort.append("rdt_strftime(item['rdt'], '%W')")
                         this_path.append(f"format_week(item['rdt'], '{part}')")
                     if 'Y' in part:
-                        this_sort.append("item['rdt'].format('YYYY')")
-                        this_path.append(f"item['rdt'].format('{part}')")
+                        this_sort.append("rdt_format(item['rdt'], 'YYYY')")
+                        this_path.append(f"rdt_format(item['rdt'], '{part}')")
                     if 'M' in part:
-                        this_sort.append("item['rdt'].format('MM')")
-                        this_path.append(f"item['rdt'].format('{part}')")
+                        this_sort.append("rdt_format(item['rdt'], 'MM')")
+                        this_path.append(f"rdt_format(item['rdt'], '{part}')")
                     if 'D' in part:
-                        this_sort.append("item['rdt'].format('DD')")
-                        this_path.append(f"item['rdt'].format('{part}')")
+                        this_sort.append("rdt_format(item['rdt'], 'DD')")
+                        this_path.append(f"rdt_format(item['rdt'], '{part}')")
                     if 'd' in part:
-                        this_path.append(f"item['rdt'].format('{part}')")
+                        this_path.append(f"rdt_format(item['rdt'], '{part}')")
                 grpby['sort'].extend(this_sort)
                 grpby['path'].append(this_path)
 
@@ -587,7 +628,7 @@ def get_grpby_and_filters(s, options=None):
                 grpby['sort'].append(f"item['{group.strip()}']")
 
         if grpby['dated'] or grpby['report'] in ['u', 'm', 'c']:
-            grpby['sort'].append(f"item['rdt'].format('YYYYMMDD')")
+            grpby['sort'].append(f"rdt_format(item['rdt'], 'YYYYMMDD')")
     also = []
     for part in parts:
         key = part[0]
@@ -612,6 +653,7 @@ def get_grpby_and_filters(s, options=None):
         details.extend([f"item.get('{x}', '~')" for x in also])
     details.append("item.doc_id")
     grpby['dtls'] = details
+    grpby['also'] = also
     logger.debug(f'get_grpby_and_filters: rgrpby: {grpby}; filters: {filters}')
     return grpby, filters
 
@@ -627,6 +669,171 @@ def show_query_results(text, grpby, items):
     return output, row2id
 
 
+BATCH_USAGE = """\
+usage: etm [loglevel] [etmdir] query [--jsonl|--csv] '<query>'
+   or: etm [loglevel] [etmdir] report [--jsonl|--csv] '<report>'
+
+Run a query or a complex (report) query, e.g.,
+
+    etm query 'exists u and ~exists i'
+    etm report --csv 'u i[0]; MMM YYYY; i[1:] -b 1/1 -e 3/1 -a d'
+
+and write the results to stdout, one JSON object per line
+(the default) or as CSV. Prefix the query with 'a ' to use
+the archive table. The database is opened read only and
+update queries are not allowed.
+"""
+
+# the fields written for each item by 'etm query --csv'
+query_fields = ['itemtype', 'summary', 's', 'e', 'f', 'i', 'l', 'c', 't', 'u', 'd', 'created', 'modified']
+
+
+def batch_value(obj):
+    """
+    A JSON or CSV compatible version of obj.
+    """
+    if isinstance(obj, pendulum.Duration):
+        return format_duration(obj)
+    if isinstance(obj, pendulum.Date):
+        return obj.isoformat()
+    if isinstance(obj, (list, tuple)):
+        return [batch_value(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: batch_value(v) for k, v in obj.items()}
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return str(obj)
+
+
+def batch_records(command, text, items_table, archive_table):
+    """
+    Generate a dictionary for each result of the query or report text.
+    """
+    db = items_table
+    if text.startswith('a '):
+        text = text[2:]
+        db = archive_table
+    query = ETMQuery()
+    if command == 'query':
+        ok, items = query.do_query(text, db)
+        if not ok:
+            raise ValueError(items)
+        for item in items:
+            record = {'id': item.doc_id}
+            record.update(item)
+            yield record
+        return
+
+    grpby, filters = get_grpby_and_filters(text)
+    if not grpby:
+        raise ValueError(f"not a report: '{text}'")
+    ok, items = query.do_query(filters.get('query'), db)
+    if not ok:
+        raise ValueError(items)
+    items = apply_dates_filter(items, grpby, filters, db.index.used)
+    rows, used_time = report_rows(items, grpby)
+    # the details are itemtype, summary, used time for 'u', the -a fields and doc_id
+    also = grpby.get('also', [])
+    for path, dt in rows:
+        record = {'id': dt[-1], 'path': path, 'itemtype': dt[0], 'summary': dt[1]}
+        if grpby['report'] == 'u':
+            record['minutes'] = round(dt[2].total_minutes()) if dt[2] else 0
+            record['hours'] = format_hours_and_tenths(dt[2])
+            extra = dt[3:-1]
+        else:
+            extra = dt[2:-1]
+        record.update(zip(also, extra))
+        yield record
+
+
+def batch(command, args, items_table, archive_table, out=sys.stdout):
+    """
+    The 'etm query' and 'etm report' commands. Results are written as they are produced rather than being collected into a tree. Returns an error message, if any, for sys.exit.
+    """
+    fmt = 'jsonl'
+    if args and args[0] in ['--jsonl', '--csv']:
+        fmt = args.pop(0)[2:]
+    text = " ".join(args).strip()
+    if not text or text in ['?', 'help']:
+        return BATCH_USAGE
+    if ' | ' in text:
+        return f"update queries are not allowed: '{text}'"
+    writer = None
+    count = 0
+    try:
+        for record in batch_records(command, text, items_table, archive_table):
+            if fmt == 'jsonl':
+                out.write(json.dumps(batch_value(record), ensure_ascii=False) + "\n")
+            else:
+                if writer is None:
+                    fields = ['id'] + (query_fields if command == 'query' else [x for x in record if x != 'id'])
+                    writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+                    writer.writeheader()
+                row = {}
+                for key, value in batch_value(record).items():
+                    row[key] = "; ".join([str(x) for x in value]) if isinstance(value, list) else value
+                writer.writerow(row)
+            count += 1
+    except ValueError as e:
+        return str(e)
+    except BrokenPipeError:
+        # e.g., piped to head
+        return None
+    logger.info(f"{command} '{text}': wrote {count} {fmt} records")
+    return None
+
+
+EXPORT_USAGE = """\
+usage: etm [loglevel] [etmdir] export --jsonl ['<query>']
+
+Write the documents in the items table to stdout, one JSON object
+per line, with the document id as "id" and the values serialized
+as they are in the database file, e.g.,
+
+    etm export --jsonl > items.jsonl
+    etm export --jsonl 'exists u and ~exists i' | jq .summary
+
+Only the documents matching the query, if given, are written.
+Prefix the query with 'a ' to use the archive table, e.g.,
+'a exists itemtype' for the whole archive. The output can be
+imported into another database with 'etm import --jsonl'.
+"""
+
+
+def batch_export(args, items_table, archive_table, out=sys.stdout):
+    """
+    The 'etm export' command. Documents are written one at a time as they are read or found. Returns an error message, if any, for sys.exit.
+    """
+    if not args or args[0] != '--jsonl':
+        return EXPORT_USAGE
+    text = " ".join(args[1:]).strip()
+    if text in ['?', 'help']:
+        return EXPORT_USAGE
+    db = items_table
+    if text.startswith('a '):
+        text = text[2:].strip()
+        db = archive_table
+    if ' | ' in text:
+        return f"update queries are not allowed: '{text}'"
+    if text:
+        ok, docs = ETMQuery().do_query(text, db)
+        if not ok:
+            return docs
+    else:
+        docs = db.table
+    count = 0
+    try:
+        for doc in docs:
+            record = {'id': doc.doc_id}
+            record.update(data.encode_value(dict(doc)))
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    except BrokenPipeError:
+        return None
+    logger.info(f"export '{text}': wrote {count} documents")
+    return None
+
+
 def main(etmdir, args):
 
     # from etm.view import Query
@@ -654,7 +861,7 @@ def main(etmdir, args):
             print("missing report arguments")
             continue
         print(f"query: {text}")
-        if len(self.query_text) > 1 and self.query_text[1] == ' ' and self.query_text[0] in ['s', 'u', 'm', 'c']:
+        if len(text) > 1 and text[1] == ' ' and text[0] in ['s', 'u', 'm', 'c']:
             grpby, filters = get_grpby_and_filters(text)
             if not grpby:
                 continue
@@ -46,6 +46,7 @@ def parse(s, **kwd):
 
 
 import re
+import time
 
 import subprocess # for check_output
 
@@ -54,6 +55,7 @@ import platform
 import os
 
 import pyperclip
+from etm.data import copy_document, word_regex, changes
 # set in __main__
 logger = None
 
@@ -66,6 +68,9 @@ application = None
 ############ begin query ###############################
 from tinydb import where
 from tinydb import Query
+
+# characters that make a query argument a regex rather than a literal
+regex_chars = re.compile(r'[.^$*+?{}\[\]\\|()]')
 from pygments.lexer import RegexLexer
 from pygments.token import Keyword
 from pygments.token import Literal
@@ -245,6 +250,13 @@ for "waldo" but the @d (description) entry does not:
 
     query: in summary waldo and ~includes d waldo
 
+Precede a query with 'explain ' to show how it would be
+processed instead of the results: which components could
+be answered from the database index, how many candidates
+needed testing and how long each step took. E.g.,
+
+    query: explain equals itemtype - and in summary waldo
+
 Archive queries
 ===============
 
@@ -261,6 +273,12 @@ for 'waldo' in the summary or in the description.
 Queries beginning with 'a ' are, in fact, the only way
 to see archived items from within etm itself.
 
+Queries other than update queries run in the background
+with their progress displayed in the status bar and the
+results found so far displayed as they arrive. This is
+useful for large archives. Press ^c or escape to cancel
+a query and keep the results found so far.
+
 Update queries
 ==============
 
@@ -291,6 +309,11 @@ items you want to update. Then press 'q' and the 'up'
 cursor key to restore the previous query, add ' | ' and
 the update command you want with its arguments.
 
+Before any changes are made, the number of items that
+would be changed together with the first few changes is
+displayed for confirmation. Confirmed changes are written
+to the database at once.
+
 WARNING: Since the results may not be reversible, consider
 backing up your 'db.json' database before using update
 commands. This simple command, e.g., would PERMANENTLY
@@ -485,6 +508,11 @@ Enter
     query: l
 
 to display a list of the saved keys and values.
+
+Saved queries whose keys are listed under "materialize" in
+`cfg.yaml` are kept current as items change. The number of
+items matching each is displayed in the status bar, e.g.,
+"mi:2", and submitting one requires no search.
 """
 
 class UpdateStatus():
@@ -570,7 +598,14 @@ class ETMQuery(object):
                 'detach': self.detach,      # a, b
                 }
 
-        self.changed = False
+        # (table, normalized query, revision) -> matching doc_ids, least
+        # recently used first
+        self.results = {}
+        self.max_results = 32
+        # stored query key -> (table, normalized query, test, doc_ids) for
+        # the stored queries listed in settings['materialize']
+        self.materialized = {}
+        changes.subscribe(self.table_changed)
 
         self.lexer = PygmentsLexer(TDBLexer)
         self.style = etmstyle
@@ -580,140 +615,185 @@ class ETMQuery(object):
 
         self.usage = USAGE
 
+    def plan_changes(self, items, change):
+        """
+        Return (doc_id, old, new) for each of items for which change(new), applied to a copy of the item, returns True. The items themselves are not altered.
+        """
+        now = pendulum.now('local')
+        changes = []
+        for item in items:
+            new = copy_document(item)
+            if change(new):
+                new['modified'] = now
+                changes.append((item.doc_id, item, new))
+        return changes
+
     def replace(self, a, rgx, rep, items):
         """
         Replace matches for rgx with rep in item['a']. If item['a']
         is a list, do this for each element in item['a']
         """
-        changed = []
         rep = re.sub('\\\s', ' ', rep)
-        for item in items:
-            if a in item:
-                if isinstance(item[a], list):
-                    res = []
-                    # apply to each component
-                    for item in item[a]:
-                        res.append(re.sub(rgx, rep, item, flags=re.IGNORECASE))
-                else:
-                    res = re.sub(rgx, rep, item[a], flags=re.IGNORECASE)
-                if res != item[a]:
-                    item[a] = res
-                    item['modified'] = pendulum.now('local')
-                    changed.append(item)
-        if changed:
-            write_back(dataview.db, changed)
-        return changed
+        def change(doc):
+            if a not in doc:
+                return False
+            if isinstance(doc[a], list):
+                # apply to each component
+                res = [re.sub(rgx, rep, x, flags=re.IGNORECASE) for x in doc[a]]
+            else:
+                res = re.sub(rgx, rep, doc[a], flags=re.IGNORECASE)
+            if res == doc[a]:
+                return False
+            doc[a] = res
+            return True
+        return self.plan_changes(items, change)
 
 
     def remove(self, items):
         """
         Remove items.
         """
-        rem_ids = [item.doc_id for item in items]
-        # warn
-        if rem_ids:
-            dataview.db.remove(doc_ids=rem_ids)
-            self.changed = True
+        return [(item.doc_id, item, None) for item in items]
 
     def archive(self, items):
         """
         When querying the items table, move items to the archive table and vice versa.
         """
-        rem_ids = [item.doc_id for item in items]
-
-        try:
-            if dataview.query_mode == "items table":
-                # move to archive
-                DBARCH.insert_multiple(items)
-                DBITEM.remove(doc_ids=rem_ids)
-            else:
-                # back to items
-                DBITEM.insert_multiple(items)
-                DBARCH.remove(doc_ids=rem_ids)
-        except Exception as e:
-            logger.error(f"move from {dataview.query_mode} failed for items: {items}; rem_ids: {rem_ids}; exception: {e}")
-            return False
-        else:
-            self.changed = True
+        return [(item.doc_id, item, None) for item in items]
 
 
     def delete(self, a, items):
         """
         For items having key 'a', remove the key and value from the item.
         """
-        changed = []
-        for item in items:
-            if a in item:
-                del item[a]
-                item['modified'] = pendulum.now('local')
-                changed.append(item)
-        if changed:
-            write_back(dataview.db, changed)
-            self.changed = True
-        return changed
+        def change(doc):
+            if a not in doc:
+                return False
+            del doc[a]
+            return True
+        return self.plan_changes(items, change)
 
     def set(self, a, b, items):
         """
         Set the value of item[a] = b for items
         """
-        changed = []
         b = re.sub('\\\s', ' ', b)
-        for item in items:
-            item[a] = b
-            item['modified'] = pendulum.now('local')
-            changed.append(item)
-        if changed:
-            write_back(dataview.db, changed)
-            self.changed = True
+        def change(doc):
+            if doc.get(a) == b:
+                return False
+            doc[a] = b
+            return True
+        return self.plan_changes(items, change)
 
     def provide(self, a, b, items):
         """
         Provide item['a'] = b for items without an exising entry for 'a'.
         """
-        changed = []
         b = re.sub('\\\s', ' ', b)
-        for item in items:
-            item.setdefault(a, b)
-            item['modified'] = pendulum.now('local')
-            changed.append(item)
-        if changed:
-            write_back(dataview.db, changed)
-            self.changed = True
+        def change(doc):
+            if a in doc:
+                return False
+            doc[a] = b
+            return True
+        return self.plan_changes(items, change)
 
 
     def attach(self, a, b, items):
         """
         Attach 'b' into the item['a'] list if 'b' is not in the list.
         """
-        changed = []
         b = re.sub('\\\s', ' ', b)
-        for item in items:
-            if a not in item:
-                item.setdefault(a, []).append(b)
-                item['modified'] = pendulum.now('local')
-                changed.append(item)
-            elif isinstance(item[a], list) and b not in item[a]:
-                item.setdefault(a, []).append(b)
-                item['modified'] = pendulum.now('local')
-                changed.append(item)
-        if changed:
-            write_back(dataview.db, changed)
-            self.changed = True
+        def change(doc):
+            if a not in doc:
+                doc[a] = [b]
+                return True
+            if isinstance(doc[a], list) and b not in doc[a]:
+                doc[a].append(b)
+                return True
+            return False
+        return self.plan_changes(items, change)
 
     def detach(self, a, b, items):
         """
         Detatch 'b' from the item['a'] list if it belongs to the list.
         """
-        changed = []
         b = re.sub('\\\s', ' ', b)
-        for item in items:
-            if a in item and isinstance(item[a], list) and b in item[a]:
-                item[a].remove(b)
-                item['modified'] = pendulum.now('local')
-                changed.append(item)
-        if changed:
-            write_back(dataview.db, changed)
-            self.changed = True
+        def change(doc):
+            if a in doc and isinstance(doc[a], list) and b in doc[a]:
+                doc[a].remove(b)
+                return True
+            return False
+        return self.plan_changes(items, change)
+
+
+    def plan_update(self, query, db=None):
+        """
+        Find the items matching the filter part of query and the changes the update part would make to them without making them. Returns (True, (command, changes, summary)) or (False, error message).
+        """
+        if db is None:
+            db = dataview.db
+        try:
+            ok, clauses, updt = self.parse_query(query)
+            if not ok:
+                return False, clauses
+            if not updt or updt[0] not in self.update:
+                return False, f"bad update command: '{' '.join(updt)}'. Only commands in {', '.join(self.update)} are allowed."
+            test = self.build_test(clauses)
+            if isinstance(test, str):
+                return False, test
+            items = self.search(db, clauses, test)
+            changes = self.update[updt[0]](*updt[1:], items)
+        except Exception as e:
+            return False, f"exception processing '{query}':\n{e}"
+        return True, (updt[0], changes, self.describe_changes(updt, items, changes))
+
+
+    def describe_changes(self, updt, items, changes, num=10):
+        """
+        A summary of changes with the first num of them shown in detail.
+        """
+        command = updt[0]
+        if command in ['remove', 'archive']:
+            verb = 'removed' if command == 'remove' else f"moved from the {dataview.query_mode if dataview else 'items table'}"
+            lines = [f"{len(changes)} of {len(items)} matching items will be {verb}"]
+            lines.extend([f"  {doc_id}: {old.get('summary', '~')}" for doc_id, old, new in changes[:num]])
+        else:
+            a = updt[1] if len(updt) > 1 else ''
+            lines = [f"{len(changes)} of {len(items)} matching items will be changed by '{' '.join(updt)}'"]
+            lines.extend([f"  {doc_id}: {a}: {old.get(a, '~')} -> {new.get(a, '~')}" for doc_id, old, new in changes[:num]])
+        if len(changes) > num:
+            lines.append(f"  and {len(changes) - num} more")
+        return "\n".join(lines)
+
+
+    def apply_update(self, command, changes, db=None):
+        """
+        Make the changes from plan_update using a single write for each table involved.
+        """
+        if not changes:
+            return False
+        if db is None:
+            db = dataview.db
+        rem_ids = [doc_id for doc_id, old, new in changes]
+        if command == 'remove':
+            db.remove(doc_ids=rem_ids)
+        elif command == 'archive':
+            items = [old for doc_id, old, new in changes]
+            try:
+                if db is DBITEM:
+                    # move to archive
+                    DBARCH.insert_multiple(items)
+                    DBITEM.remove(doc_ids=rem_ids)
+                else:
+                    # back to items
+                    DBITEM.insert_multiple(items)
+                    DBARCH.remove(doc_ids=rem_ids)
+            except Exception as e:
+                logger.error(f"move from {db} failed for items: {items}; rem_ids: {rem_ids}; exception: {e}")
+                return False
+        else:
+            write_back(db, [new for doc_id, old, new in changes])
+        return True
 
 
     def is_datetime(self, val):
@@ -888,9 +968,9 @@ class ETMQuery(object):
         return self.Item[a].test(self.op[b[0]], b[1])
 
 
-    def process_query(self, query):
+    def parse_query(self, query):
         """
-
+        Split query into a list of clauses, (negation, command, args), separated by the connectives 'and' or 'or', together with the update command and its arguments, if any.
         """
         [fltr, *updt] = [x.strip() for x in query.split(" | ")]
         if len(updt) == 1:
@@ -901,72 +981,326 @@ class ETMQuery(object):
 
         parts = [x.split() for x in re.split(r' (and|or) ', fltr)]
 
-        cmnds = []
+        clauses = []
         for part in parts:
             part = [x.strip() for x in part if x.strip()]
+            if part[0] in ['and', 'or']:
+                clauses.append(part[0])
+                continue
             negation = part[0].startswith('~')
-            if part[0] not in ['and', 'or']:
-                # we have a command
-                if negation:
-                    # drop the ~
-                    part[0] = part[0][1:]
-                if self.filters.get(part[0], None) is None:
-                    return False, wrap(f"""bad command: '{part[0]}'. Only commands in {self.allowed_commands} are allowed."""), updt
+            # drop the ~
+            command = part[0][1:] if negation else part[0]
+            if self.filters.get(command, None) is None:
+                return False, wrap(f"""bad command: '{command}'. Only commands in {self.allowed_commands} are allowed."""), updt
 
             if len(part) > 3:
-                if part[0] in ['in', 'includes']:
-                    if negation:
-                        cmnds.append(~ self.filters[part[0]]([x.strip() for x in part[1:-1]], part[-1]))
-                    else:
-                        cmnds.append(self.filters[part[0]]([x.strip() for x in part[1:-1]], part[-1]))
+                if command in ['in', 'includes']:
+                    args = ([x.strip() for x in part[1:-1]], part[-1])
                 else:
-                    if negation:
-                        cmnds.append(~ self.filters[part[0]](part[1], [x.strip() for x in part[2:]]))
-                    else:
-                        cmnds.append(self.filters[part[0]](part[1], [x.strip() for x in part[2:]]))
-            elif len(part) > 2:
-                if negation:
-                    cmnds.append(~ self.filters[part[0]](part[1], part[2]))
-                else:
-                    cmnds.append(self.filters[part[0]](part[1], part[2]))
-            elif len(part) > 1:
-                if negation:
-                    cmnds.append(~ self.filters[part[0]](part[1]))
+                    args = (part[1], [x.strip() for x in part[2:]])
+            else:
+                args = tuple(part[1:])
+            clauses.append((negation, command, args))
+        return True, clauses, updt
+
+
+    def build_test(self, clauses):
+        """
+        Combine the TinyDB tests for clauses from left to right. Returns a string rather than a test for 'info'.
+        """
+        test = None
+        andor = 'and'
+        for clause in clauses:
+            if clause in ['and', 'or']:
+                andor = clause
+                continue
+            negation, command, args = clause
+            res = self.filters[command](*args)
+            if isinstance(res, str):
+                # info
+                return res
+            res = ~ res if negation else res
+            if test is None:
+                test = res
+            else:
+                test = test | res if andor == 'or' else test & res
+        return test
+
+
+    def process_query(self, query):
+        """
+
+        """
+        ok, clauses, updt = self.parse_query(query)
+        if not ok:
+            return False, clauses, updt
+        return True, self.build_test(clauses), updt
+
+
+    def candidates(self, index, command, args):
+        """
+        Return (doc_ids, exact) where doc_ids is the set of ids of documents that could satisfy the clause, or None if the index cannot help, and exact is True if every document in doc_ids satisfies the clause.
+        """
+        if command == 'exists' and len(args) == 1:
+            return index.with_key(args[0]), True
+        if command == 'equals' and len(args) == 2 and args[0] in index.value_fields:
+            b = args[1]
+            try:
+                b = int(b)
+            except:
+                pass
+            return index.with_value(args[0], b), True
+        if command == 'one' and len(args) == 2 and args[0] in index.value_fields:
+            values = args[1] if isinstance(args[1], list) else [args[1]]
+            ids = set()
+            for value in values:
+                ids |= index.with_value(args[0], value)
+            return ids, True
+        if command in ['any', 'all'] and len(args) == 2 and args[0] in index.list_fields:
+            values = args[1] if isinstance(args[1], list) else [args[1]]
+            sets = [index.with_value(args[0], value) for value in values]
+            if command == 'any':
+                return set().union(*sets), True
+            return set.intersection(*sets), True
+        if command == 'dt' and len(args) == 2 and args[0] in index.date_fields and isinstance(args[1], list) and len(args[1]) == 2 and args[1][0] in self.op:
+            # only year, month and day are indexed and > and < compare these
+            # component by component so the result is a superset
+            try:
+                ymd = [int(x) for x in args[1][1].split('-')[:3]]
+            except ValueError:
+                return None, False
+            if args[1][0] == '=':
+                begin = tuple(ymd)
+                end = tuple(ymd[:-1] + [ymd[-1] + 1])
+            elif args[1][0] == '>':
+                begin, end = (ymd[0], ), (10000, )
+            else:
+                begin, end = (0, ), (ymd[0] + 1, )
+            return index.in_dates(args[0], begin, end), False
+        if command in ['begins', 'includes', 'in'] and len(args) == 2 and isinstance(args[1], str):
+            # a literal match lies within the words of the field, so every
+            # word in args[1] is part of a word in the field and, for begins,
+            # the first is the start of a word. The result is a superset.
+            fields = args[0] if isinstance(args[0], list) else [args[0]]
+            if regex_chars.search(args[1]) or not all(x in index.text_fields for x in fields):
+                return None, False
+            words = word_regex.findall(args[1].lower())
+            if not words:
+                return None, False
+            ids = set()
+            for field in fields:
+                first = index.with_prefix(field, words[0]) if command == 'begins' else index.with_part(field, words[0])
+                ids |= first.intersection(*[index.with_part(field, x) for x in words[1:]])
+            return ids, False
+        return None, False
+
+
+    def plan_query(self, index, clauses):
+        """
+        Combine the candidates for each clause from left to right, just as build_test combines the tests. Returns (doc_ids, exact, steps) where doc_ids is None if every document must be tested, exact is True if the tests can be skipped and steps describes the plan.
+        """
+        ids = None
+        exact = True
+        steps = []
+        andor = None
+        for clause in clauses:
+            if clause in ['and', 'or']:
+                andor = clause
+                continue
+            negation, command, args = clause
+            found, found_exact = (None, False) if negation else self.candidates(index, command, args)
+            desc = f"{'~' if negation else ''}{command} {' '.join([' '.join(x) if isinstance(x, list) else x for x in args])}"
+            if found is None:
+                steps.append(f"{andor or ''} {desc}: test each candidate".strip())
+            else:
+                steps.append(f"{andor or ''} {desc}: {len(found)} from index{'' if found_exact else ', then test'}".strip())
+            if andor is None:
+                ids, exact = found, found is not None and found_exact
+            elif andor == 'and':
+                if found is None:
+                    exact = False
                 else:
-                    cmnds.append(self.filters[part[0]](part[1]))
+                    ids = found if ids is None else ids & found
+                    exact = exact and found_exact
             else:
-                cmnds.append(part[0])
+                if found is None or ids is None:
+                    ids, exact = None, False
+                else:
+                    ids = ids | found
+                    exact = exact and found_exact
+        return ids, exact, steps
+
+
+    def search(self, db, clauses, test, explain=False):
+        """
+        Return the documents in db satisfying test, using the index of db when available to limit the documents tested. With explain, return a description of the plan and timings instead.
+        """
+        index = getattr(db, 'index', None)
+        if index is None:
+            items = db.search(test)
+            return items if not explain else f"{len(items)} items from a scan of the table"
+        start = time.perf_counter()
+        ids, exact, steps = self.plan_query(index, clauses)
+        planned = time.perf_counter()
+        docs = index.docs
+        if ids is None:
+            candidates = list(docs.values())
+        else:
+            candidates = [docs[x] for x in sorted(ids) if x in docs]
+        matches = candidates if exact else [doc for doc in candidates if test(doc)]
+        items = [copy_document(doc) for doc in matches]
+        finished = time.perf_counter()
+        if not explain:
+            return items
+        lines = [f"plan for {len(docs)} documents:"]
+        lines.extend([f"  {x}" for x in steps])
+        lines.append(f"candidates: {'all' if ids is None else len(candidates)}; tested: {0 if exact else len(candidates)}; matches: {len(matches)}")
+        lines.append(f"planning: {1000 * (planned - start):.1f} ms; fetching and testing: {1000 * (finished - planned):.1f} ms")
+        return "\n".join(lines)
+
+
+    def search_shards(self, db, clauses, test, size=1000):
+        """
+        Generate (done, total, matches) for successive shards of the candidates for clauses in db, taken in doc_id order, so that a long search can report its progress and be abandoned between shards.
+        """
+        index = db.index
+        ids, exact, steps = self.plan_query(index, clauses)
+        docs = index.docs
+        candidates = sorted(docs) if ids is None else sorted([x for x in ids if x in docs])
+        total = len(candidates)
+        for i in range(0, total, size):
+            shard = [docs[x] for x in candidates[i:i+size]]
+            matches = shard if exact else [doc for doc in shard if test(doc)]
+            yield min(i + size, total), total, [copy_document(doc) for doc in matches]
+
+
+    def table_changed(self, revision, name, changes):
+        """
+        Subscriber to data.changes. Drop the cached results for the changed table - they can no longer be used since the revision has changed.
+        """
+        for key in [x for x in self.results if x[0] == name]:
+            del self.results[key]
+        # only the changed documents need to be tested
+        for table, query, test, ids in self.materialized.values():
+            if table != name:
+                continue
+            for doc_id, old, new in changes:
+                if new is not None and test(new):
+                    ids.add(doc_id)
+                else:
+                    ids.discard(doc_id)
+
 
-        test = cmnds[0]
-        for i in range(1, len(cmnds)):
-            if i % 2 and cmnds[i] in ['and', 'or']:
-                andor = cmnds[i]
+    def materialize(self, settings):
+        """
+        Find the doc_ids for each of the stored queries whose keys are listed in settings['materialize']. These are kept current by table_changed and used by cached_search in place of searching. For complex queries, the filter query, -q, is materialized. Update queries are skipped.
+        """
+        queries = settings.get('queries') or {}
+        for key in settings.get('materialize') or []:
+            text = queries.get(key, None)
+            if not text:
+                logger.warning(f"materialize: '{key}' is not a key in queries")
+                continue
+            if ' | ' in text:
+                logger.warning(f"materialize: skipping the update query '{key}: {text}'")
                 continue
-            test = test | cmnds[i] if andor == 'or' else test & cmnds[i]
-        return True, test, updt
+            db = DBITEM
+            if text.startswith('a '):
+                text = text[2:]
+                db = DBARCH
+            if len(text) > 1 and text[1] == ' ' and text[0] in ['s', 'u', 'm', 'c']:
+                text = report.get_grpby_and_filters(text)[1].get('query', '')
+            try:
+                ok, clauses, updt = self.parse_query(text)
+                test = self.build_test(clauses) if ok else clauses
+            except Exception as e:
+                ok, test = False, e
+            if not ok or isinstance(test, str) or test is None:
+                logger.warning(f"materialize: skipping '{key}: {text}': {test}")
+                continue
+            ids = set([x.doc_id for x in self.search(db, clauses, test)])
+            self.materialized[key] = (db.name, " ".join(text.split()), test, ids)
+            logger.info(f"materialized '{key}: {text}' with {len(ids)} items")
 
 
-    def do_query(self, query):
+    def materialized_counts(self):
+        """
+        The stored query keys and the number of items matching each, e.g., 'td:3 mi:0'.
+        """
+        return " ".join([f"{key}:{len(x[3])}" for key, x in self.materialized.items()])
+
+
+    def cached_ids(self, db, query):
+        """
+        The doc_ids of the materialized query or of the stored results for the same table, query and revision, if any, and otherwise None.
+        """
+        normalized = " ".join(query.split())
+        for table, materialized, test, ids in self.materialized.values():
+            if table == db.name and materialized == normalized:
+                return sorted(ids)
+        key = (db.name, normalized, changes.revision)
+        ids = self.results.pop(key, None)
+        if ids is not None:
+            self.results[key] = ids
+        return ids
+
+
+    def store_ids(self, db, query, ids, revision):
+        """
+        Store the doc_ids matching query in db as of revision, discarding the least recently used results if necessary.
+        """
+        self.results[(db.name, " ".join(query.split()), revision)] = ids
+        while len(self.results) > self.max_results:
+            del self.results[next(iter(self.results))]
+
+
+    def cached_search(self, db, query, clauses, test):
+        """
+        Return search(db, clauses, test) using cached_ids if possible and otherwise storing the doc_ids found.
         """
+        index = getattr(db, 'index', None)
+        if index is None:
+            return self.search(db, clauses, test)
+        ids = self.cached_ids(db, query)
+        if ids is not None:
+            return [copy_document(index.docs[x]) for x in ids if x in index.docs]
+        revision = changes.revision
+        items = self.search(db, clauses, test)
+        self.store_ids(db, query, [x.doc_id for x in items], revision)
+        return items
+
+
+    def do_query(self, query, db=None):
         """
+        Process query using db, by default that of dataview.
+        """
+        if db is None:
+            db = dataview.db
         if query in ["?", "help"]:
             return False, self.usage
+        explain = query.startswith('explain ')
+        if explain:
+            query = query[len('explain '):]
         try:
-            ok, test, updt = self.process_query(query)
+            ok, clauses, updt = self.parse_query(query)
             if not ok:
-                return False, test
+                return False, clauses
+            test = self.build_test(clauses)
             if isinstance(test, str):
                 # info
                 return False, test
-            else:
-                items = dataview.db.search(test)
-                if updt:
-                    self.update[updt[0]](*updt[1:], items)
-                    if self.changed:
-                        loop = asyncio.get_event_loop()
-                        loop.call_later(0, data_changed, loop)
-                        self.changed = False
-                return True, items
+            if explain:
+                return False, f"query: {query}\n{self.search(db, clauses, test, True)}"
+            if not updt:
+                return True, self.cached_search(db, query, clauses, test)
+            ok, res = self.plan_update(query, db)
+            if not ok:
+                return False, res
+            command, changes, summary = res
+            if self.apply_update(command, changes, db):
+                loop = asyncio.get_event_loop()
+                loop.call_later(0, data_changed, loop)
+            return True, [new for doc_id, old, new in changes if new is not None]
         except Exception as e:
             return False, f"exception processing '{query}':\n{e}"
 
@@ -1344,8 +1678,6 @@ def add_usedtime(*event):
         if changed:
             dataview.timer_clear(doc_id)
 
-            if doc_id in dataview.itemcache:
-                del dataview.itemcache[doc_id]
             application.layout.focus(text_area)
             set_text(dataview.show_active_view())
             loop = asyncio.get_event_loop()
@@ -1652,9 +1984,7 @@ def item_changed(loop):
         else:
             state = 'r'
             dataview.active_timer = item.doc_id
-        dataview.timers[item.doc_id] = [state, pendulum.now('local'), pendulum.Duration()]
-    dataview.update_completions(item)
-    dataview.update_konnections(item)
+        dataview.set_timer(item.doc_id, state, pendulum.now('local'), pendulum.Duration())
     data_changed(loop)
 
 def data_changed(loop):
@@ -1829,11 +2159,18 @@ def get_edit_mode():
 
 
 def get_statusbar_text():
-    return [ ('class:status',  f' {current_datetime}'), ]
+    counts = query.materialized_counts()
+    return [ ('class:status',  f' {current_datetime}{"  " + counts if counts else ""}'), ]
 
 def get_statusbar_center_text():
     if dataview.is_editing:
         return [ ('class:status',  f' {get_edit_mode()}'), ]
+    if is_searching():
+        return [ ('class:status',  f' {query_progress}'), ]
+    if import_progress:
+        return [ ('class:status',  f' {import_progress}'), ]
+    if startup_progress:
+        return [ ('class:status',  f' {startup_progress}'), ]
     if dataview.is_showing_query:
         return [ ('class:status',  f' {dataview.query_mode}'), ]
     return [ ('class:status',  14 * ' '), ]
@@ -1902,8 +2239,8 @@ class AtCompleter(Completer):
         if word:
             word_len = len(word)
             word = word.rstrip()
-            for completion in completions:
-                if word.startswith('@x') and completion.startswith(word):
+            for completion in completions.with_prefix(word):
+                if word.startswith('@x'):
                     if completion == word:
                         replacement = expansions.get(word[3:], completion)
                         yield Completion(
@@ -1992,7 +2329,7 @@ and then submit.
 
         loop = asyncio.get_event_loop()
         loop.call_later(0, do_show_processing, loop)
-        loop.call_later(.1, do_complex_query, text, loop)
+        loop.call_later(0, do_complex_query, text, loop)
 
     else:
         # quitting
@@ -2027,7 +2364,110 @@ query_area = HSplit([
     query_window,
     ], style='class:entry')
 
+def show_query(text, grpby, filters, items):
+    if grpby:
+        items = report.apply_dates_filter(items, grpby, filters, dataview.db.index.used)
+    dataview.set_query(text, grpby, items)
+    application.layout.focus(text_area)
+    set_text(dataview.show_active_view())
+
+# the running query, if any, and its progress
+query_task = None
+query_progress = ""
+
+@Condition
+def is_searching():
+    return query_task is not None and not query_task.done()
+
+async def run_query(text, db):
+    """
+    Search db in shards, yielding to the event loop between them so that input, the clock and alerts are handled, the progress is displayed in the status bar, the results so far are displayed and the search can be cancelled.
+    """
+    global query_progress
+    grpby = filters = {}
+    fltr = text
+    if len(text) > 1 and text[1] == ' ' and text[0] in ['s', 'u', 'm', 'c']:
+        grpby, filters = report.get_grpby_and_filters(text)
+        fltr = filters.get('query')
+    try:
+        ok, clauses, updt = query.parse_query(fltr)
+        test = query.build_test(clauses) if ok else clauses
+    except Exception as e:
+        ok, test = False, f"exception processing '{fltr}':\n{e}"
+    if not ok or isinstance(test, str):
+        set_text(test)
+        return
+    items = []
+    try:
+        if not db.loaded:
+            query_progress = "loading"
+            get_app().invalidate()
+            # the first use of the index reads the table
+            await asyncio.get_event_loop().run_in_executor(None, getattr, db, 'index')
+        ids = query.cached_ids(db, fltr)
+        if ids is not None:
+            show_query(text, grpby, filters, [copy_document(db.index.docs[x]) for x in ids if x in db.index.docs])
+            return
+        revision = changes.revision
+        shown = time.perf_counter()
+        for done, total, matches in query.search_shards(db, clauses, test):
+            items.extend(matches)
+            query_progress = f"{done}/{total}"
+            if matches and time.perf_counter() - shown > 0.25:
+                # display the results so far
+                show_query(text, grpby, filters, items)
+                shown = time.perf_counter()
+            get_app().invalidate()
+            await asyncio.sleep(0)
+        query.store_ids(db, fltr, [x.doc_id for x in items], revision)
+        show_query(text, grpby, filters, items)
+    except asyncio.CancelledError:
+        if items:
+            show_query(text, grpby, filters, items)
+            show_message("query", f"cancelled - showing the {len(items)} items found before cancelling", 2)
+        else:
+            set_text(f"cancelled query: {text}")
+    except Exception as e:
+        set_text(f"exception processing '{fltr}':\n{e}")
+    finally:
+        query_progress = ""
+        get_app().invalidate()
+
+def confirm_update(text, update_query):
+    """
+    Display a summary of the changes update_query would make and, if confirmed, make them and then display the results of the query text. The changes are not made if the data has changed while the dialog was displayed since they would overwrite those changes.
+    """
+    revision = changes.revision
+    ok, res = query.plan_update(update_query)
+    if not ok:
+        set_text(res)
+        return
+    command, planned, summary = res
+    if not planned:
+        set_text(f"query: {update_query}\n{summary}")
+        return
+
+    def coroutine():
+        global query_task
+        dialog = ConfirmDialog("update", f"{summary}\n\nMake these changes?")
+        confirmed = yield from show_dialog_as_float(dialog)
+        if not confirmed:
+            set_text(f"query: {update_query}\nno changes made\n{summary}")
+            return
+        if changes.revision != revision:
+            set_text(f"query: {update_query}\nno changes made since the data changed while confirming - submit the query again to make them")
+            return
+        query.apply_update(command, planned)
+        loop = asyncio.get_event_loop()
+        data_changed(loop)
+        if is_searching():
+            query_task.cancel()
+        query_task = asyncio.ensure_future(run_query(text, dataview.db))
+
+    asyncio.ensure_future(coroutine())
+
 def do_complex_query(text, loop):
+    global query_task
     text, *updt = [x.strip() for x in text.split(' | ')]
     updt = f" | {updt[0]}" if updt else ""
     if text.startswith('a '):
@@ -2038,22 +2478,31 @@ def do_complex_query(text, loop):
         dataview.use_items()
         item.use_items()
 
+    if updt:
+        fltr = text
+        if len(text) > 1 and text[1] == ' ' and text[0] in ['s', 'u', 'm', 'c']:
+            fltr = report.get_grpby_and_filters(text)[1].get('query')
+        confirm_update(text, fltr + updt)
+        return
+
+    if not (text in ['?', 'help'] or text.startswith('explain ')):
+        # update queries, help and explain are processed at once
+        if is_searching():
+            query_task.cancel()
+        query_task = asyncio.ensure_future(run_query(text, dataview.db))
+        return
+
     if len(text) > 1 and text[1] == ' ' and text[0] in ['s', 'u', 'm', 'c']:
         grpby, filters = report.get_grpby_and_filters(text)
         ok, items = query.do_query(filters.get('query') + updt)
         if ok:
-            items = report.apply_dates_filter(items, grpby, filters)
-            dataview.set_query(text, grpby, items)
-            application.layout.focus(text_area)
-            set_text(dataview.show_active_view())
+            show_query(text, grpby, filters, items)
         else:
             set_text(items)
     else:
         ok, items = query.do_query(text + updt)
         if ok:
-            dataview.set_query(f"{text + updt}", {}, items)
-            application.layout.focus(text_area)
-            set_text(dataview.show_active_view())
+            show_query(f"{text + updt}", {}, {}, items)
         else:
             set_text(items)
 
@@ -2137,8 +2586,6 @@ def do_schedule_new(*event):
             show_message('new instance', f"'{new_datetime}' is invalid")
 
         if changed:
-            if doc_id in dataview.itemcache:
-                del dataview.itemcache[doc_id]
             application.layout.focus(text_area)
             set_text(dataview.show_active_view())
             loop = asyncio.get_event_loop()
@@ -2190,8 +2637,6 @@ def do_reschedule(*event):
             show_message('new instance', f"'{new_datetime}' is invalid")
 
         if changed:
-            if doc_id in dataview.itemcache:
-                del dataview.itemcache[doc_id]
             application.layout.focus(text_area)
             set_text(dataview.show_active_view())
             loop = asyncio.get_event_loop()
@@ -2222,8 +2667,6 @@ def do_maybe_delete(*event):
                 if has_timer:
                     dataview.timer_clear(doc_id)
                 item.delete_item(doc_id)
-                if doc_id in dataview.itemcache:
-                    del dataview.itemcache[doc_id]
                 application.layout.focus(text_area)
                 set_text(dataview.show_active_view())
                 loop = asyncio.get_event_loop()
@@ -2252,8 +2695,6 @@ def do_maybe_delete(*event):
             if which is not None:
                 changed = item.delete_instances(doc_id, instance, which)
                 if changed:
-                    if doc_id in dataview.itemcache:
-                        del dataview.itemcache[doc_id]
                     application.layout.focus(text_area)
                     set_text(dataview.show_active_view())
                     loop = asyncio.get_event_loop()
@@ -2430,10 +2871,7 @@ def do_finish(*event):
             if ok:
                 # valid done
                 res = item.finish_item(item_id, job_id, done, due)
-                # dataview.itemcache[item.doc_id] = {}
                 if res:
-                    if item_id in dataview.itemcache:
-                        del dataview.itemcache[item_id]
                     loop = asyncio.get_event_loop()
                     loop.call_later(0, data_changed, loop)
             else:
@@ -2529,6 +2967,7 @@ one of the following extensions:
   .json  a json file exported from etm 3.2.x
   .text  a text file with etm entries as lines
   .ics   an iCalendar file
+  .jsonl a file written by 'etm export --jsonl'
 
 Warning: files imported from the directory
    {etmhome}
@@ -2539,24 +2978,92 @@ Enter the path of the file to import:""")
         file_path = yield from show_dialog_as_float(dialog)
         if file_path:
             file_path = os.path.normpath(os.path.expanduser(file_path))
+            extension = os.path.splitext(file_path)[1]
+            if extension in ['.ics', '.jsonl'] and os.path.exists(file_path):
+                batches = model.import_ics_batches if extension == '.ics' else model.import_jsonl_batches
+                asyncio.ensure_future(run_batch_import(file_path, batches))
+                return
             ok, msg = import_file(file_path)
-            if ok:
-                etm_dir = os.path.normpath(os.path.expanduser(etmdir))
-
-                if os.path.dirname(file_path) == etm_dir:
-                    os.remove(file_path)
-                    filehome = os.path.join("~", os.path.split(file_path)[1])
-                    msg += f"\n and removed {filehome}"
-                dataview.refreshRelevant()
-                dataview.refreshAgenda()
-                dataview.refreshCurrent()
-                dataview.refresh_konnections()
-                loop = asyncio.get_event_loop()
-                loop.call_later(0, data_changed, loop)
-            show_message('import file', msg)
+            finish_import(file_path, ok, msg)
 
     asyncio.ensure_future(coroutine())
 
+def finish_import(file_path, ok, msg):
+    if ok:
+        etm_dir = os.path.normpath(os.path.expanduser(etmdir))
+
+        if os.path.dirname(file_path) == etm_dir:
+            os.remove(file_path)
+            filehome = os.path.join("~", os.path.split(file_path)[1])
+            msg += f"\n and removed {filehome}"
+        dataview.refreshRelevant()
+        dataview.refreshAgenda()
+        dataview.refreshCurrent()
+        dataview.refresh_konnections()
+        loop = asyncio.get_event_loop()
+        loop.call_later(0, data_changed, loop)
+    show_message('import file', msg)
+
+# the progress of the running ics or jsonl import, if any
+import_progress = ""
+
+async def run_batch_import(file_path, batches):
+    """
+    Import file_path a batch at a time using batches, yielding to the event loop between batches and displaying the number of items imported in the status bar.
+    """
+    global import_progress
+    imported, dups, ids = 0, 0, []
+    try:
+        for imported, dups, ids in batches(file_path):
+            import_progress = f"imported {imported}"
+            get_app().invalidate()
+            await asyncio.sleep(0)
+    except Exception as e:
+        logger.error(f"error importing {file_path}: {e}")
+        msg = f"error importing {file_path}: {e}"
+        if imported:
+            msg += f"\n{model.import_message(imported, dups, ids)}"
+        # keep the file since it was not completely imported
+        finish_import("", bool(imported), msg)
+        return
+    finally:
+        import_progress = ""
+        get_app().invalidate()
+    finish_import(file_path, True, model.import_message(imported, dups, ids))
+
+# the startup stage being run, if any
+startup_progress = ""
+
+async def run_startup(first_paint):
+    """
+    Once the agenda for the current week has been displayed, run the startup stages deferred by DataView and then materialize the stored queries, yielding to the event loop between them and displaying the stage in the status bar.
+    """
+    global startup_progress
+    await first_paint.wait()
+    try:
+        for name, stage in dataview.startup_stages():
+            startup_progress = f"loading {name}"
+            get_app().invalidate()
+            await asyncio.sleep(0)
+            try:
+                stage()
+            except Exception as e:
+                logger.error(f"error in startup stage {name}: {e}")
+        if settings.get('materialize'):
+            startup_progress = "loading queries"
+            get_app().invalidate()
+            # the first use of the index reads the table
+            await asyncio.get_event_loop().run_in_executor(None, getattr, DBITEM, 'index')
+            try:
+                query.materialize(settings)
+            except Exception as e:
+                logger.error(f"error materializing queries: {e}")
+    finally:
+        startup_progress = ""
+    if not (dataview.is_editing or dataview.is_showing_details):
+        set_text(dataview.show_active_view())
+    get_app().invalidate()
+
 
 @bindings.add('c-t', 'c-t', filter=is_viewing & is_item_view)
 def do_whatever(*event):
@@ -2588,7 +3095,7 @@ def toggle_archived_status(*event):
         item.use_items()
         loop.call_later(0, data_changed, loop)
         # loop.call_later(0, do_show_processing, loop)
-        loop.call_later(.1, do_complex_query, text, loop)
+        loop.call_later(0, do_complex_query, text, loop)
     return
 
 
@@ -2617,7 +3124,19 @@ def copy_details(*event):
     pyperclip.copy(details)
     show_message("copy", "details copied to system clipboard", 2)
 
+# added after the copy bindings so that it takes precedence
+@bindings.add('c-c', filter=is_searching)
+@bindings.add('escape', filter=is_searching)
+def cancel_query(*event):
+    query_task.cancel()
+
 def set_text(txt, row=0):
+    """
+    The text_area window only lexes and draws the rows in view and the buffer document indexes its line starts once per text, so the cost of a refresh is in swapping in new text. Skip the swap when the rendered view is unchanged and just return the cursor to the top as before.
+    """
+    if txt == text_area.text:
+        text_area.buffer.cursor_position = 0
+        return
     text_area.text = txt
 
 @bindings.add('a', filter=is_viewing)
@@ -2840,8 +3359,6 @@ def maybe_save(item):
         # item needs correcting, return to edit
         return
     # hsh ok, save changes and close editor
-    if item.doc_id in dataview.itemcache:
-        del dataview.itemcache[item.doc_id]
 
     app = get_app()
     app.editing_mode = EditingMode.EMACS
@@ -2968,10 +3485,14 @@ async def main(etmdir=""):
         mouse_support=True,
         style=style,
         full_screen=True)
+    first_paint = asyncio.Event()
+    application.after_render += lambda app: first_paint.set()
     background_task = asyncio.create_task(event_handler())
+    startup_task = asyncio.create_task(run_startup(first_paint))
     try:
         await application.run_async()
     finally:
+        startup_task.cancel()
         background_task.cancel()
         logger.info("Quitting event loop.")
 